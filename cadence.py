@@ -0,0 +1,96 @@
+"""
+Cadence plans for curves that share one set of observation times, such as the
+fields in validation/. Everything in the network inputs that depends only on the
+times is computed once per plan, so the inputs of a whole field reduce to a few
+matrix products. The precomputed periodogram is the exact one; with
+LightCurve.PSPEC_MODE set to anything else the power inputs are computed curve by
+curve with that mode, as for any other batch.
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.ndimage import gaussian_filter1d
+from lightcurve import LightCurve
+from features import sanitise_nan_mean, evaluate, NODES, CHUNK_SIZE
+from raw_nodes import PSPEC_PERIODS
+
+class CadencePlan:
+
+  def __init__(self, dates, periods=PSPEC_PERIODS):
+    self.dates = np.asarray(dates, dtype=float)
+    self.size = len(self.dates)
+    self.build_interpolation()
+    self.build_slope_basis()
+    self.build_periodogram(periods)
+
+  def build_interpolation(self):
+    """ The resampling in LightCurve.interpolate_smooth as a sparse matrix. np.interp
+    is linear in the fluxes, so column j is the interpolation of the j'th unit
+    vector; this also reproduces np.interp where the dates are not sorted. """
+    t = np.linspace(self.dates[0], self.dates[-1], self.size)
+    rows, cols, weights = [], [], []
+    unit = np.zeros(self.size)
+    for j in range(self.size):
+      unit[j] = 1
+      column = np.interp(t, self.dates, unit)
+      unit[j] = 0
+      nonzero = np.flatnonzero(column)
+      rows.append(nonzero)
+      cols.append(np.full(len(nonzero), j))
+      weights.append(column[nonzero])
+
+    self.interp = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(self.size, self.size))
+
+  def build_slope_basis(self):
+    """ Basis of the weighted least squares line, centred for conditioning. """
+    centred = self.dates - np.mean(self.dates)
+    self.slope_basis = np.stack([np.ones(self.size), centred, centred**2], axis=1)
+
+  def build_periodogram(self, periods):
+    """ Sine and cosine tables of the Lomb-Scargle periodogram, shifted by the
+    frequency offset tau, and their squared sums. """
+    self.ang_freqs = 2 * np.pi / periods
+    wt = np.outer(self.ang_freqs, self.dates)
+    tau = np.arctan2(np.sin(2 * wt).sum(axis=1), np.cos(2 * wt).sum(axis=1)) / (2 * self.ang_freqs)
+    phase = wt - (self.ang_freqs * tau)[:, None]
+    self.cos_table, self.sin_table = np.cos(phase), np.sin(phase)
+    self.cos_norm = (self.cos_table**2).sum(axis=1)
+    self.sin_norm = (self.sin_table**2).sum(axis=1)
+
+  def inputs(self, flux, flux_err, names=None, chunk_size=CHUNK_SIZE):
+    """ Returns the ``(n, len(names))`` inputs of all curves in ``flux``, as
+    LightCurve.load_curve followed by calculate_inputs for every row. """
+    names = names or LightCurve.INPUT_NAMES
+    nodes = dict(NODES)
+    nodes['smoothed'] = (('y',), self.smoothed)
+    nodes['slope'] = (('y', 'sigma'), self.fitted_slopes)
+    if LightCurve.PSPEC_MODE == 'exact':
+      nodes['power'] = (('y',), self.power)
+
+    inputs = np.zeros((len(flux), len(names)))
+    for start in range(0, len(flux), chunk_size):
+      end = start + chunk_size
+      y, sigma = sanitise_nan_mean(flux[start:end]), sanitise_nan_mean(flux_err[start:end])
+      n = np.full(len(y), self.size)
+      valid = np.ones(y.shape, dtype=bool)
+      x = np.broadcast_to(self.dates, y.shape)
+      inputs[start:end] = evaluate(names, {'x': x, 'y': y, 'sigma': sigma, 'n': n, 'valid': valid}, nodes)
+    return inputs
+
+  def smoothed(self, flux):
+    """ Interpolated and smoothed fluxes, as LightCurve.interpolate_smooth. """
+    return gaussian_filter1d((self.interp @ flux.T).T, LightCurve.SMOOTH_SIGMA, axis=1)
+
+  def fitted_slopes(self, flux, error):
+    """ Weighted least squares slopes, as LightCurve.fitted_slope. """
+    weights = 1 / error**2
+    sw, swx, swxx = (weights @ self.slope_basis).T
+    swy, swxy = ((weights * flux) @ self.slope_basis[:, :2]).T
+    return (sw * swxy - swx * swy) / (sw * swxx - swx**2)
+
+  def power(self, flux):
+    """ Peak power and angular frequency of the normalised periodogram, as pspec. """
+    shifted = flux - np.mean(flux, axis=1, keepdims=True)
+    ys, yc = shifted @ self.sin_table.T, shifted @ self.cos_table.T
+    ps = (yc**2 / self.cos_norm + ys**2 / self.sin_norm) / (shifted**2).sum(axis=1, keepdims=True)
+    return np.max(ps, axis=1), self.ang_freqs[np.argmax(ps, axis=1)]
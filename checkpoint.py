@@ -0,0 +1,150 @@
+"""
+Checkpoints of a training run, written in the background so that the training
+loop never waits on disk. A checkpoint is a binary network file, the state of
+its optimizer and a JSON state file naming both; the state file is replaced
+last, so it always points at a complete checkpoint.
+"""
+
+import os
+import json
+import copy
+import random
+import threading
+import traceback
+import numpy as np
+from network import load, save_optimizer, load_optimizer
+
+STATE_FILE = 'checkpoint.json'
+
+class CheckpointWriter:
+
+  def __init__(self, directory='.'):
+    self.directory = directory
+    self.pending = None
+    self.busy = False
+    self.closed = False
+    self.error = None
+    self.condition = threading.Condition()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def save(self, nn, state, copies=()):
+    """ Queues a checkpoint of ``nn`` and the JSON-serialisable ``state`` and
+    returns at once. Both are snapshotted here, so training may continue to
+    modify them. ``copies`` are further file names to save the network to. A
+    queued checkpoint that has not been written yet is replaced. Raises the
+    error of a previous checkpoint that failed to be written. """
+    snapshot = (nn.copy(), copy.deepcopy(state), list(copies))
+    with self.condition:
+      self.raise_error()
+      self.pending = snapshot
+      self.condition.notify_all()
+
+  def run(self):
+    while True:
+      with self.condition:
+        while self.pending is None and not self.closed:
+          self.condition.wait()
+        if self.pending is None:
+          return
+        nn, state, copies = self.pending
+        self.pending = None
+        self.busy = True
+
+      error = None
+      try:
+        self.write(nn, state, copies)
+      except Exception as e:
+        # Reported here at once and raised again by the next save or flush
+        print("Failed to write the checkpoint of iteration " + str(state.get('iterations')) + ":")
+        traceback.print_exc()
+        error = e
+      with self.condition:
+        if error is not None:
+          self.error = error
+        self.busy = False
+        self.condition.notify_all()
+
+  def raise_error(self):
+    """ Raises, once, the error of the last checkpoint that failed. Called with
+    the condition held. """
+    if self.error is not None:
+      error, self.error = self.error, None
+      raise error
+
+  def write(self, nn, state, copies):
+    previous = read_state(self.directory)
+    network_file = 'checkpoint-%d.nnb' % state['iterations']
+    optimizer_file = 'checkpoint-%d.opt' % state['iterations']
+    write_atomic(os.path.join(self.directory, network_file), nn.save_binary)
+    def dump_optimizer(filename):
+      with open(filename, 'wb') as f:
+        save_optimizer(nn.optimizer, f)
+    write_atomic(os.path.join(self.directory, optimizer_file), dump_optimizer)
+    for filename in copies:
+      write_atomic(os.path.join(self.directory, filename), nn.save_binary)
+
+    state = dict(state, network=network_file, optimizer=optimizer_file)
+    def dump(filename):
+      with open(filename, 'w') as f:
+        json.dump(state, f)
+    write_atomic(os.path.join(self.directory, STATE_FILE), dump)
+
+    if previous is not None and previous['network'] != network_file:
+      for key in ['network', 'optimizer']:
+        try:
+          os.remove(os.path.join(self.directory, previous[key]))
+        except (KeyError, FileNotFoundError):
+          pass
+
+  def flush(self):
+    """ Blocks until every queued checkpoint is written, and raises the error of
+    one that failed. """
+    with self.condition:
+      while self.pending is not None or self.busy:
+        self.condition.wait()
+      self.raise_error()
+
+  def close(self):
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+    self.thread.join()
+
+def write_atomic(filename, write):
+  """ Calls ``write`` with a temporary name and moves the result to ``filename``. """
+  tmp_filename = filename + '.tmp'
+  write(tmp_filename)
+  os.replace(tmp_filename, filename)
+
+def read_state(directory='.'):
+  path = os.path.join(directory, STATE_FILE)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+def load_checkpoint(directory='.'):
+  """ Returns the network, with its optimizer, and the state of the last
+  checkpoint in ``directory``, or None if there is none. """
+  state = read_state(directory)
+  if state is None:
+    return None
+  nn = load(os.path.join(directory, state['network']))
+  if 'optimizer' in state:
+    with open(os.path.join(directory, state['optimizer']), 'rb') as f:
+      nn.optimizer = load_optimizer(f)
+  return nn, state
+
+def rng_state():
+  """ JSON-serialisable state of the global random and numpy.random generators. """
+  version, internal, gauss = random.getstate()
+  name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+  return {'random': [version, list(internal), gauss],
+          'numpy': [name, keys.tolist(), pos, has_gauss, cached_gaussian]}
+
+def restore_rng(state):
+  version, internal, gauss = state['random']
+  random.setstate((version, tuple(internal), gauss))
+  name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+  np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
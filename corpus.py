@@ -0,0 +1,169 @@
+"""
+Offline training corpora: generate curves once, keep their network inputs and
+train on them as often as needed.
+
+A corpus is a directory of shards, each three .npy files that load memory-mapped:
+the ``(n, INPUT_SIZE)`` inputs, the labels as indices into OUTPUT_TYPES and the
+``(n, len(params))`` table of generating parameters, NaN where a parameter does
+not apply to the curve's type. ``manifest.json`` names the shards, inputs,
+parameters and feature version; it is written last, once every shard is complete.
+Shard ``i`` is drawn from its own generator seeded by ``(seed, i)``, so a corpus
+is reproducible. Each shard also gets a ``.json`` file, written after its arrays,
+recording the seed, size, types and feature version that produced it; when writing
+resumes, shards whose record matches are kept and the rest are generated again.
+
+Usage: python corpus.py DIRECTORY --curves N [--shard-size S] [--workers W] [--seed SEED]
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import multiprocessing as mp
+from lightcurve import LightCurve, MicroLensing, NonEvent, Periodic, generate_batch, filter_batch
+from features import batch_inputs
+
+MANIFEST = 'manifest.json'
+SHARD_SIZE = 100000
+
+# Curves generated at a time while writing a shard
+CHUNK_SIZE = 1000
+
+# Shards mixed together by Corpus.batches
+SHARDS_IN_MEMORY = 4
+
+def param_names(types):
+  """ Sorted names of all the parameters drawn for ``types``. """
+  rng = np.random.default_rng(0)
+  return sorted(set().union(*[curve_type.draw_params(0, rng) for curve_type in types]))
+
+def shard_files(directory, index):
+  base = os.path.join(directory, 'shard-%05d' % index)
+  return {part: base + '.' + part + '.npy' for part in ['inputs', 'labels', 'params']}
+
+def shard_record(directory, index):
+  """ The settings shard ``index`` was written with, or None if it is incomplete. """
+  record_path = os.path.join(directory, 'shard-%05d.json' % index)
+  files = shard_files(directory, index)
+  if not all(os.path.exists(path) for path in [record_path] + list(files.values())):
+    return None
+  with open(record_path) as f:
+    return json.load(f)
+
+def write_shard(directory, index, size, seed, types):
+  """ Generates shard ``index`` of ``size`` curves unless it exists already with
+  the same settings. Every file is written under a temporary name and moved into
+  place, the record last. """
+  files = shard_files(directory, index)
+  record = {'seed': seed, 'size': size, 'types': [curve_type.__name__ for curve_type in types],
+            'feature_version': LightCurve.FEATURE_VERSION}
+  if shard_record(directory, index) == record:
+    return index
+
+  rng = np.random.default_rng([seed, index])
+  names = param_names(types)
+  inputs = np.zeros((size, LightCurve.INPUT_SIZE))
+  labels = np.zeros(size, dtype=np.int8)
+  params = np.full((size, len(names)), np.nan)
+  for start in range(0, size, CHUNK_SIZE):
+    end = min(start + CHUNK_SIZE, size)
+    curves, batch_labels, batch_params = generate_batch(types, end - start, rng=rng)
+    mask = filter_batch(curves, batch_labels, rng)
+    inputs[start:end] = batch_inputs(curves, mask)
+    labels[start:end] = batch_labels
+    for column, name in enumerate(names):
+      if name in batch_params:
+        params[start:end, column] = batch_params[name]
+
+  for part, array in [('inputs', inputs), ('labels', labels), ('params', params)]:
+    tmp_path = files[part] + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.save(f, array)
+    os.replace(tmp_path, files[part])
+  record_path = os.path.join(directory, 'shard-%05d.json' % index)
+  with open(record_path + '.tmp', 'w') as f:
+    json.dump(record, f)
+  os.replace(record_path + '.tmp', record_path)
+  return index
+
+def write_corpus(directory, curves, shard_size=SHARD_SIZE, workers=1, seed=0, types=None):
+  """ Writes a corpus of ``curves`` curves drawn from ``types`` to ``directory``,
+  ``workers`` shards at a time. """
+  types = types or [MicroLensing, NonEvent, Periodic]
+  os.makedirs(directory, exist_ok=True)
+  # Shards may change below, so the directory is not a corpus until the new manifest is written
+  if os.path.exists(os.path.join(directory, MANIFEST)):
+    os.remove(os.path.join(directory, MANIFEST))
+  sizes = [min(shard_size, curves - start) for start in range(0, curves, shard_size)]
+
+  with mp.Pool(workers) as pool:
+    jobs = [pool.apply_async(write_shard, (directory, i, size, seed, types)) for i, size in enumerate(sizes)]
+    for done, job in enumerate(jobs):
+      job.get()
+      print("Shard " + str(done + 1) + " / " + str(len(jobs)) + " written")
+      sys.stdout.flush()
+
+  manifest = {'feature_version': LightCurve.FEATURE_VERSION,
+              'inputs': LightCurve.INPUT_NAMES,
+              'params': param_names(types),
+              'types': [curve_type.__name__ for curve_type in types],
+              'seed': seed,
+              'shards': [{'index': i, 'size': size} for i, size in enumerate(sizes)]}
+  tmp_path = os.path.join(directory, MANIFEST + '.tmp')
+  with open(tmp_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+class Corpus:
+
+  def __init__(self, directory):
+    self.directory = directory
+    with open(os.path.join(directory, MANIFEST)) as f:
+      self.manifest = json.load(f)
+    self.feature_version = self.manifest['feature_version']
+    self.inputs = self.manifest['inputs']
+    self.params = self.manifest['params']
+    self.size = sum(shard['size'] for shard in self.manifest['shards'])
+
+  def __len__(self):
+    return self.size
+
+  def shard(self, index):
+    """ Memory-mapped inputs, labels and parameters of shard ``index``. """
+    files = shard_files(self.directory, index)
+    return tuple(np.load(files[part], mmap_mode='r') for part in ['inputs', 'labels', 'params'])
+
+  def batches(self, batch_size, rng=None, shards_in_memory=SHARDS_IN_MEMORY, epochs=None):
+    """ Yields ``(x, y)`` batches of ``batch_size`` inputs and one-hot expected
+    outputs, one sample per row, passing over the corpus ``epochs`` times (for
+    ever by default). Each pass visits the shards in a random order,
+    ``shards_in_memory`` at a time, and shuffles the rows of those shards
+    together. Rows left over at the end of a group carry into the next. """
+    rng = rng or np.random.default_rng()
+    outputs = np.eye(LightCurve.OUTPUT_SIZE)
+    x_rest, labels_rest = np.zeros((0, len(self.inputs))), np.zeros(0, dtype=np.int8)
+    epoch = 0
+    while epochs is None or epoch < epochs:
+      order = rng.permutation(len(self.manifest['shards']))
+      for start in range(0, len(order), shards_in_memory):
+        group = [self.shard(self.manifest['shards'][i]['index']) for i in order[start:start + shards_in_memory]]
+        x = np.concatenate([x_rest] + [inputs for inputs, _, _ in group])
+        labels = np.concatenate([labels_rest] + [labels for _, labels, _ in group])
+        rows = rng.permutation(len(x))
+        end = len(rows) - len(rows) % batch_size
+        for k in range(0, end, batch_size):
+          batch = rows[k:k + batch_size]
+          yield x[batch], outputs[labels[batch]]
+        x_rest, labels_rest = x[rows[end:]], labels[rows[end:]]
+      epoch += 1
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Write a sharded training corpus of generated lightcurves.")
+  parser.add_argument('directory')
+  parser.add_argument('--curves', type=int, required=True, help="number of curves to generate")
+  parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help="curves per shard (default: %(default)s)")
+  parser.add_argument('--workers', type=int, default=1, help="shards generated in parallel")
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  write_corpus(args.directory, args.curves, args.shard_size, args.workers, args.seed)
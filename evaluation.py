@@ -0,0 +1,88 @@
+"""
+Held-out evaluation of a training run. The evaluation set is generated once from
+a fixed seed and its features are cached on disk, so every evaluation scores the
+same curves. An Evaluator process scores snapshots of the network while training
+carries on.
+"""
+
+import queue
+import numpy as np
+import multiprocessing as mp
+from lightcurve import OUTPUT_TYPES, generate_batch, filter_batch
+from features import batch_inputs
+from feature_cache import cached_features
+
+EVAL_SIZE = 10000
+EVAL_SEED = 1
+CACHE_DIR = 'cache/'
+
+# Curves generated at a time while building the evaluation set
+EVAL_CHUNK = 1000
+
+def evaluation_set(types, size=EVAL_SIZE, seed=EVAL_SEED, cache_dir=CACHE_DIR):
+  """ Returns the ``(size, inputs)`` inputs and the labels of ``size`` curves drawn
+  from ``types`` with the generator seeded by ``seed``, generating them on the
+  first call and loading them from ``cache_dir`` afterwards. """
+  key = [np.array(['evaluation'] + [curve_type.__name__ for curve_type in types]), np.array([size, seed])]
+
+  def compute():
+    rng = np.random.default_rng(seed)
+    rows = []
+    for start in range(0, size, EVAL_CHUNK):
+      curves, labels, _ = generate_batch(types, min(EVAL_CHUNK, size - start), rng=rng)
+      mask = filter_batch(curves, labels, rng)
+      rows.append(np.column_stack([batch_inputs(curves, mask), labels]))
+    return np.concatenate(rows)
+
+  data = cached_features(cache_dir, key, compute)
+  return data[:, :-1], data[:, -1].astype(int)
+
+def score(nn, inputs, labels):
+  """ Returns the accuracy, the accuracy on each type in OUTPUT_TYPES and the mean
+  cost of ``nn`` on the labelled ``inputs``. """
+  outputs = nn.predict_batch(inputs)
+  predicted = np.argmax(outputs, axis=1)
+  expected = np.eye(nn.sizes[-1])[labels]
+  result = {'accuracy': float(np.mean(predicted == labels)),
+            'cost': float(nn.cost.fn(outputs, expected) / len(labels))}
+  for i, curve_type in enumerate(OUTPUT_TYPES):
+    if np.any(labels == i):
+      result['accuracy_' + curve_type.__name__] = float(np.mean(predicted[labels == i] == i))
+  return result
+
+def evaluation_process(snapshots, results, types, size, seed, cache_dir):
+  inputs, labels = evaluation_set(types, size, seed, cache_dir)
+  while True:
+    nn, info = snapshots.get()
+    results.put(dict(info, **score(nn, inputs, labels)))
+
+class Evaluator:
+
+  def __init__(self, types, size=EVAL_SIZE, seed=EVAL_SEED, cache_dir=CACHE_DIR):
+    self.snapshots = mp.Queue(maxsize=1)
+    self.results = mp.Queue()
+    self.process = mp.Process(target=evaluation_process, daemon=True,
+                              args=(self.snapshots, self.results, types, size, seed, cache_dir))
+    self.process.start()
+
+  def submit(self, nn, **info):
+    """ Queues a snapshot of ``nn`` to be scored unless an earlier one is still
+    waiting, and returns whether it was queued. ``info`` is returned with the
+    scores. """
+    # Checked first so that a rejected snapshot does not copy the network
+    if self.snapshots.full():
+      return False
+    try:
+      self.snapshots.put_nowait((nn.copy(), info))
+      return True
+    except queue.Full:
+      return False
+
+  def poll(self):
+    """ Returns the results of the evaluations finished since the last call. """
+    results = []
+    while True:
+      try:
+        results.append(self.results.get_nowait())
+      except queue.Empty:
+        return results
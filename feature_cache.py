@@ -0,0 +1,38 @@
+"""
+Content-addressed on-disk cache of feature matrices. Entries are keyed by a hash
+of the input arrays, LightCurve.FEATURE_VERSION and the feature settings (the
+autocorrelation backend, the periodogram mode and its period grid), stored as
+.npy files and returned memory-mapped, so a changed input, feature definition or
+setting simply misses.
+"""
+
+import os
+import hashlib
+import numpy as np
+from lightcurve import LightCurve
+from raw_nodes import PSPEC_PERIODS
+
+def content_key(arrays):
+  """ Hex digest of the feature version and settings and the dtype, shape and
+  bytes of every array in ``arrays``. """
+  digest = hashlib.blake2b(digest_size=20)
+  digest.update(('features-v%d-%s-%s' % (LightCurve.FEATURE_VERSION, LightCurve.AC_BACKEND, LightCurve.PSPEC_MODE)).encode())
+  for array in [PSPEC_PERIODS] + list(arrays):
+    array = np.ascontiguousarray(array)
+    digest.update(('%s%s' % (array.dtype.str, array.shape)).encode())
+    digest.update(memoryview(array).cast('B'))
+  return digest.hexdigest()
+
+def cached_features(cache_dir, arrays, compute):
+  """ Returns the feature matrix for ``arrays`` from ``cache_dir``, calling
+  ``compute()`` and storing its result on a miss. """
+  path = os.path.join(cache_dir, content_key(arrays) + '.npy')
+  if not os.path.exists(path):
+    features = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'wb') as f:
+      np.save(f, features)
+    os.replace(tmp_path, path)
+
+  return np.load(path, mmap_mode='r')
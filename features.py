@@ -0,0 +1,240 @@
+"""
+Batch feature extraction. Computes the network inputs of many curves at once,
+column for column the same as LightCurve.calculate_inputs.
+
+Curves are given in the LightCurve column layout as an ``(n, size, 5)`` array
+with an optional ``(n, size)`` keep mask, as returned by generate_batch and
+filter_batch. Masked samples are treated as removed. Times must increase along
+each curve; fields that share one (possibly unsorted) set of dates are better
+served by cadence.CadencePlan.
+"""
+
+import numpy as np
+from lightcurve import LightCurve
+from raw_nodes import excursion_batch, pspec, lag_correlations
+from profiling import stage
+
+CHUNK_SIZE = 1024
+
+# Truncation of the gaussian kernel, as in scipy.ndimage.gaussian_filter
+SMOOTH_TRUNCATE = 4.0
+
+def load_batch(times, flux, error):
+  """ Builds a curve batch from a shared ``times`` array and ``(n, size)`` flux and
+  error arrays, replacing NaNs like LightCurve.sanitise_nan_mean. """
+  flux = sanitise_nan_mean(flux)
+  curves = np.zeros(flux.shape + (5,))
+  curves[:, :, LightCurve.CURVE_X] = times
+  curves[:, :, LightCurve.CURVE_Y] = flux
+  curves[:, :, LightCurve.CURVE_SIGMA] = sanitise_nan_mean(error)
+  return curves
+
+def sanitise_nan_mean(array):
+  """ Row-wise LightCurve.sanitise_nan_mean: NaNs become the row mean, where the
+  mean itself counts NaNs as zero. """
+  array = np.array(array, dtype=float)
+  mean_val = np.mean(np.nan_to_num(array), axis=1, keepdims=True)
+  return np.where(np.isnan(array), mean_val, array)
+
+# Registry of feature nodes: name -> (names of the nodes it is computed from, function)
+NODES = {}
+
+def node(*deps):
+  """ Registers the decorated function as the node of the same name, computed from
+  the values of the nodes ``deps``. """
+  def register(fn):
+    NODES[fn.__name__] = (deps, fn)
+    return fn
+  return register
+
+def evaluate(names, values, nodes=NODES):
+  """ Computes the nodes ``names`` from the known node ``values`` of a batch, which
+  initially hold the curve data 'x', 'y', 'sigma', 'n' and 'valid'. Every
+  intermediate is computed once and only if a requested node depends on it.
+  Returns the ``(n, len(names))`` matrix of the requested nodes. """
+  def get(name):
+    if name not in values:
+      deps, fn = nodes[name]
+      args = [get(dep) for dep in deps]
+      with stage('features.' + name, len(values['n'])):
+        values[name] = fn(*args)
+    return values[name]
+
+  return np.stack([get(name) for name in names], axis=1)
+
+def batch_inputs(curves, mask=None, names=None, chunk_size=CHUNK_SIZE):
+  """ Returns the ``(n, len(names))`` input matrix for a batch of curves, all of
+  LightCurve.INPUT_NAMES by default. """
+  if mask is None:
+    mask = np.ones(curves.shape[:2], dtype=bool)
+  names = names or LightCurve.INPUT_NAMES
+
+  inputs = np.zeros((len(curves), len(names)))
+  for start in range(0, len(curves), chunk_size):
+    end = start + chunk_size
+    x, y, sigma, n = compact(curves[start:end], mask[start:end])
+    valid = np.arange(x.shape[1]) < n[:, None]
+    inputs[start:end] = evaluate(names, {'x': x, 'y': y, 'sigma': sigma, 'n': n, 'valid': valid})
+  return inputs
+
+#### Intermediates
+
+@node('x', 'y', 'n')
+def smoothed(x, y, n):
+  return interpolate_smooth(x, y, n)
+
+@node('smoothed', 'n')
+def correlations(smoothed, n):
+  return autocorrelations(smoothed, n)
+
+@node('y', 'valid')
+def excursion(y, valid):
+  return excursion_batch(y, valid)
+
+@node('x', 'y', 'sigma', 'valid')
+def slope(x, y, sigma, valid):
+  return weighted_slope(x, y, 1 / sigma**2, valid)
+
+@node('x', 'y', 'n')
+def power(x, y, n):
+  power = np.zeros((2, len(x)))
+  for i in range(len(x)):
+    power[:, i] = pspec(np.stack([x[i, :n[i]], y[i, :n[i]]], axis=1), LightCurve.PSPEC_MODE)
+  return power
+
+#### Network inputs, named as the LightCurve methods
+
+@node('correlations')
+def ac_width(correlations):
+  ac, _, lags = correlations
+  return masked_stdev(ac, lags)
+
+@node('correlations')
+def ac_max(correlations):
+  ac, _, lags = correlations
+  return np.where(lags, ac, -np.inf).max(axis=1)
+
+@node('correlations')
+def ac_symm_width(correlations):
+  _, ac_symm, lags = correlations
+  return masked_stdev(ac_symm, lags)
+
+@node('correlations')
+def ac_symm_max(correlations):
+  _, ac_symm, lags = correlations
+  return np.where(lags, ac_symm, -np.inf).max(axis=1)
+
+@node('excursion')
+def excursion_diff(excursion):
+  return excursion[0]
+
+@node('excursion')
+def excursion_above(excursion):
+  return excursion[1]
+
+@node('excursion')
+def excursion_below(excursion):
+  return excursion[2]
+
+@node('y', 'sigma', 'valid')
+def noise_est(y, sigma, valid):
+  return masked_mean(sigma, valid) / masked_stdev(y, valid)
+
+@node('slope')
+def fitted_slope(slope):
+  return np.abs(1 - slope)
+
+@node('power')
+def power_peak(power):
+  return power[1]
+
+@node('power')
+def power_mean(power):
+  return power[0]
+
+#### Batch helpers
+
+def compact(curves, mask):
+  """ Moves the kept samples of every curve to the front, preserving their order.
+  Returns times, fluxes and errors of shape ``(n, size)`` and the kept counts. """
+  order = np.argsort(~mask, axis=1, kind='stable')
+  x, y, sigma = [np.take_along_axis(curves[:, :, column], order, axis=1)
+                 for column in [LightCurve.CURVE_X, LightCurve.CURVE_Y, LightCurve.CURVE_SIGMA]]
+  n = mask.sum(axis=1)
+  padding = np.arange(x.shape[1]) >= n[:, None]
+  sigma[padding] = 1
+  return x, y, sigma, n
+
+def masked_mean(values, valid):
+  return np.where(valid, values, 0).sum(axis=1) / valid.sum(axis=1)
+
+def masked_stdev(values, valid):
+  """ Sample standard deviation over the valid entries, as statistics.stdev. """
+  mean = masked_mean(values, valid)
+  squares = np.where(valid, (values - mean[:, None])**2, 0).sum(axis=1)
+  return np.sqrt(squares / (valid.sum(axis=1) - 1))
+
+def weighted_slope(x, y, w, valid):
+  """ Slope of the weighted least squares line, as np.polyfit(x, y, 1, w=sqrt(w)). """
+  w = np.where(valid, w, 0)
+  x_mean = (w * x).sum(axis=1, keepdims=True) / w.sum(axis=1, keepdims=True)
+  y_mean = (w * y).sum(axis=1, keepdims=True) / w.sum(axis=1, keepdims=True)
+  dx = x - x_mean
+  return (w * dx * (y - y_mean)).sum(axis=1) / (w * dx**2).sum(axis=1)
+
+def interpolate_smooth(x, y, n):
+  """ Batch LightCurve.interpolate_smooth: resamples each curve onto ``n`` evenly
+  spaced times and applies the reflected gaussian filter. """
+  size = x.shape[1]
+  rows = np.arange(len(x))
+  j = np.arange(size)
+  first, last = x[:, 0], x[rows, n - 1]
+  t = first[:, None] + j * ((last - first) / (n - 1))[:, None]
+  t[rows, n - 1] = last
+
+  # Searching all rows at once: each row is mapped into its own unit interval
+  span = np.where(last > first, last - first, 1)[:, None]
+  padding = j >= n[:, None]
+  x_key = 2 * rows[:, None] + np.where(padding, 1.5, (x - first[:, None]) / span)
+  t_key = 2 * rows[:, None] + (t - first[:, None]) / span
+  index = np.searchsorted(x_key.ravel(), t_key.ravel(), side='right').reshape(t.shape)
+  index = np.clip(index - 1 - size * rows[:, None], 0, np.maximum(n - 2, 0)[:, None])
+
+  x_lo, x_hi = np.take_along_axis(x, index, axis=1), np.take_along_axis(x, index + 1, axis=1)
+  y_lo, y_hi = np.take_along_axis(y, index, axis=1), np.take_along_axis(y, index + 1, axis=1)
+  dx = x_hi - x_lo
+  weight = np.where(dx > 0, (t - x_lo) / np.where(dx > 0, dx, 1), 0)
+  interpolated = y_lo + weight * (y_hi - y_lo)
+
+  return gaussian_smooth(interpolated, n, LightCurve.SMOOTH_SIGMA)
+
+def gaussian_smooth(values, n, sigma):
+  """ scipy.ndimage.gaussian_filter with mode 'reflect' on rows of length ``n``. """
+  radius = int(SMOOTH_TRUNCATE * sigma + 0.5)
+  offsets = np.arange(-radius, radius + 1)
+  kernel = np.exp(-0.5 / sigma**2 * offsets**2)
+  kernel /= kernel.sum()
+
+  j = np.arange(values.shape[1])
+  period = 2 * n[:, None]
+  smoothed = np.zeros(values.shape)
+  for offset, weight in zip(offsets, kernel):
+    index = np.mod(j + offset, period)
+    index = np.where(index >= n[:, None], period - 1 - index, index)
+    smoothed += weight * np.take_along_axis(values, np.minimum(index, values.shape[1] - 1), axis=1)
+  return smoothed
+
+def autocorrelations(smoothed, n):
+  """ Normalised forward and reversed ("symmetry") correlations of each curve, as
+  LightCurve.autocorrelate. Returns both and the mask of valid lags; lag ``k`` is
+  valid for ``k < n - n//2``. """
+  size = smoothed.shape[1]
+  valid = np.arange(size) < n[:, None]
+  shifted = np.where(valid, smoothed - masked_mean(smoothed, valid)[:, None], 0)
+  corr, corr_symm = lag_correlations(shifted, n)
+
+  k = np.arange(size)
+  lags = k < (n - n//2)[:, None]
+  lengths = np.maximum(n[:, None] - k, 1)
+  ac, ac_symm = corr / lengths, corr_symm / lengths
+  return ac / ac[:, :1], ac_symm / ac_symm[:, :1], lags
@@ -0,0 +1,70 @@
+"""
+Array-level versions of the LightCurve filters. Every filter works on a single
+curve of shape (size,) or a batch of shape (n, size), draws from an explicit
+numpy.random.Generator and leaves the time axis alone: sample removal is
+returned as a boolean keep mask instead of deleting rows.
+"""
+
+import numpy as np
+
+# Probability that a sample outside a gap survives the patchy filter
+PATCHY_KEEP = 2 / 5
+# Probability that a surviving sample starts a gap, and the largest gap drawn
+PATCHY_GAP_CHANCE = 1 / 15
+PATCHY_GAP_MAX = 30
+
+MAX_DIPS = 10
+
+def noise_sigma(flux, rng):
+  """ Draws per-sample error bars with a random scale per curve and returns the
+  noisy flux together with the error bars. """
+  flux = np.asarray(flux)
+  scale = rng.integers(1, 101, flux.shape[:-1] + (1,)) / 100
+  errbar = np.abs(rng.normal(0, scale, flux.shape))
+  return flux + rng.normal(0, errbar), errbar
+
+def patchy_mask(shape, rng):
+  """ Returns the keep mask of the patchy filter for curves of ``shape``.
+
+  Each sample outside a gap is kept with probability PATCHY_KEEP and every kept
+  sample opens a gap with probability PATCHY_GAP_CHANCE. Distances between
+  consecutive kept samples are therefore independent, so the kept positions are
+  the cumulative sum of one draw per possible kept sample. """
+  shape = (shape,) if np.isscalar(shape) else tuple(shape)
+  size = shape[-1]
+  rows = int(np.prod(shape[:-1]))
+
+  steps = rng.geometric(PATCHY_KEEP, (rows, size))
+  gap_len = np.maximum(rng.integers(0, PATCHY_GAP_MAX + 1, (rows, size)) - 1, 0)
+  gaps = gap_len * (rng.random((rows, size)) < PATCHY_GAP_CHANCE)
+
+  positions = np.cumsum(steps, axis=1) - 1
+  positions[:, 1:] += np.cumsum(gaps[:, :-1], axis=1)
+
+  keep = np.zeros((rows, size), dtype=bool)
+  row, col = np.nonzero(positions < size)
+  keep[row, positions[row, col]] = True
+  return keep.reshape(shape)
+
+def dips(flux, clean_flux, rng, mask=None):
+  """ Subtracts up to MAX_DIPS single-sample dips from each curve, each a random
+  fraction of the mean clean flux, at kept positions chosen with replacement. """
+  flux = np.array(flux, dtype=float)
+  batch = np.atleast_2d(flux)
+  clean = np.atleast_2d(clean_flux)
+  keep = np.ones(batch.shape, dtype=bool) if mask is None else np.atleast_2d(mask)
+
+  rows, size = batch.shape
+  num_kept = keep.sum(axis=1)
+  flux_mean = np.abs((clean * keep).sum(axis=1) / np.maximum(num_kept, 1))
+
+  count = rng.integers(0, MAX_DIPS + 1, (rows, 1))
+  active = (np.arange(MAX_DIPS) < count) & (num_kept[:, None] > 0)
+  rank = (rng.random((rows, MAX_DIPS)) * num_kept[:, None]).astype(int)
+  kept_positions = np.argsort(~keep, axis=1, kind='stable')
+  target = np.take_along_axis(kept_positions, np.minimum(rank, size - 1), axis=1)
+  depth = flux_mean[:, None] * rng.uniform(0.6, 1.2, (rows, MAX_DIPS))
+
+  row = np.broadcast_to(np.arange(rows)[:, None], target.shape)
+  np.subtract.at(batch, (row[active], target[active]), depth[active])
+  return batch.reshape(flux.shape)
@@ -1,8 +1,9 @@
 import numpy as np
-import random
 import time
 import statistics
-from raw_nodes import excursion, pspec
+from raw_nodes import excursion, pspec, lag_correlations
+from filters import noise_sigma, patchy_mask, dips
+from profiling import timed, stage
 from scipy.ndimage import gaussian_filter
 
 class LightCurve:
@@ -16,13 +17,33 @@ class LightCurve:
   # This varies the smoothing accuracy when using gaussian_filter
   SMOOTH_SIGMA = 2
 
+  # 'fft' computes both correlation variants from one transform in O(n log n),
+  # 'direct' uses np.correlate and is kept for comparison
+  AC_BACKEND = 'fft'
+
+  # Periodogram engine passed to pspec, 'exact' or 'fast'
+  PSPEC_MODE = 'exact'
+
   INPUT_SIZE = 11
   OUTPUT_SIZE = 3
 
-  def __init__(self):
+  # Network inputs in column order, each the name of the method computing it
+  INPUT_NAMES = ['ac_width', 'ac_max', 'ac_symm_width', 'ac_symm_max', 'excursion_diff', 'excursion_above', 'excursion_below', 'noise_est', 'fitted_slope', 'power_peak', 'power_mean']
+
+  # Bump whenever calculate_inputs or any feature definition changes, this
+  # invalidates cached feature matrices
+  FEATURE_VERSION = 2
+
+  def __init__(self, rng=None):
+    """ ``rng`` is the numpy.random.Generator all parameters, curves and filters
+    are drawn from, a fresh one by default. """
     self.input_neurons = []
     if not hasattr(self, 'params'):
       self.params = []
+    if rng is not None:
+      self.rng = rng
+    elif not hasattr(self, 'rng'):
+      self.rng = np.random.default_rng()
     self.curve = None
     self.size = 1000
     self.corr = [None, None]
@@ -39,6 +60,35 @@ class LightCurve:
     """ Overridden by child classes """
     pass
 
+  @classmethod
+  def draw_params(cls, n, rng):
+    """ Overridden by child classes. Returns a dict of ``n`` parameter draws per
+    parameter name, including the time offset normally drawn in generate_curve. """
+    return {}
+
+  @classmethod
+  def evaluate_batch(cls, params, size):
+    """ Overridden by child classes. Returns the ``(n, size)`` times and fluxes for
+    the parameter table ``params``. """
+    pass
+
+  @classmethod
+  def generate_batch(cls, n, size=1000, rng=None):
+    """ Generates ``n`` curves of this class as one ``(n, size, 5)`` array in the
+    same column layout as ``self.curve``, together with the parameter table that
+    produced them. The curves are noise-free: the clean columns are filled and
+    CURVE_SIGMA is zero, exactly as before apply_filters in generate_curve. """
+    if rng is None:
+      rng = np.random.default_rng()
+
+    params = cls.draw_params(n, rng)
+    curves = np.zeros((n, size, 5))
+    curves[:, :, cls.CURVE_X], curves[:, :, cls.CURVE_Y] = cls.evaluate_batch(params, size)
+    curves[:, :, cls.CURVE_X_CLEAN] = curves[:, :, cls.CURVE_X]
+    curves[:, :, cls.CURVE_Y_CLEAN] = curves[:, :, cls.CURVE_Y]
+
+    return curves, params
+
   @staticmethod
   def sanitise_nan_mean(array):
     mean_val = np.mean(np.nan_to_num(array))
@@ -55,24 +105,25 @@ class LightCurve:
     self.curve[:, self.CURVE_Y] = self.sanitise_nan_mean(flux)
     self.curve[:, self.CURVE_SIGMA] = self.sanitise_nan_mean(error)
 
-  def calculate_inputs(self):
+  def calculate_inputs(self, names=None):
     if self.curve is None:
       self.generate_curve()
 
-    input_list = [self.ac_width, self.ac_max, self.ac_symm_width, self.ac_symm_max, self.excursion_diff, self.excursion_above, self.excursion_below, self.noise_est, self.fitted_slope, self.power_peak, self.power_mean]
-    inputs = np.zeros((self.INPUT_SIZE, 1))
-    for i in range(self.INPUT_SIZE):
-      inputs[i] = input_list[i]()
+    names = names or self.INPUT_NAMES
+    inputs = np.zeros((len(names), 1))
+    for i in range(len(names)):
+      with stage(names[i]):
+        inputs[i] = getattr(self, names[i])()
     return inputs
 
   def ac_width(self):
     return statistics.stdev(self.autocorrelate())
 
   def ac_max(self):
-    return max(self.autocorrelate(False, False))
+    return max(self.autocorrelate())
 
   def ac_symm_max(self):
-    return max(self.autocorrelate(True, False))
+    return max(self.autocorrelate(True))
 
   def ac_symm_width(self):
     return statistics.stdev(self.autocorrelate(True))
@@ -103,13 +154,13 @@ class LightCurve:
 
   def power_peak(self):
     if self.power is None:
-      self.power = pspec(self.curve[:, :2])
+      self.power = pspec(self.curve[:, :2], self.PSPEC_MODE)
 
     return self.power[1]
 
   def power_mean(self):
     if self.power is None:
-      self.power = pspec(self.curve[:, :2])
+      self.power = pspec(self.curve[:, :2], self.PSPEC_MODE)
 
     return self.power[0]
 
@@ -119,15 +170,23 @@ class LightCurve:
 
     t, y = self.interpolate_smooth()
     y_shift = y - np.mean(y)
-    y2 = np.flip(y_shift, axis=0) if rev else y_shift
-    corr = np.correlate(y_shift, y2, mode='same')
-    n = len(corr)
-
+    n = len(y_shift)
     lengths = range(n, n//2, -1)
-    ac = corr[n//2:] / lengths
+
+    if self.AC_BACKEND == 'fft':
+      corrs = [corr[:len(lengths)] for corr in lag_correlations(y_shift)]
+    elif self.AC_BACKEND == 'direct':
+      y2 = np.flip(y_shift, axis=0) if rev else y_shift
+      corrs = [None, None]
+      corrs[int(rev)] = np.correlate(y_shift, y2, mode='same')[n//2:]
+    else:
+      raise ValueError("Unknown autocorrelation backend '%s'" % self.AC_BACKEND)
 
     if normalise:
-      self.corr[int(rev)] = ac / ac[0] # Normalise
+      for i, corr in enumerate(corrs):
+        if corr is not None:
+          ac = corr / lengths
+          self.corr[i] = ac / ac[0] # Normalise
 
     return self.corr[int(rev)]
 
@@ -142,10 +201,9 @@ class LightCurve:
     return self.smoothed
 
   def expected_outputs(self):
-    light_curves = [NonEvent, MicroLensing, Periodic]
     outputs = np.zeros((self.OUTPUT_SIZE, 1))
     for i in range(self.OUTPUT_SIZE):
-      outputs[i, 0] = int(isinstance(self, light_curves[i]))
+      outputs[i, 0] = int(isinstance(self, OUTPUT_TYPES[i]))
     return outputs
 
   def get_filters(self):
@@ -156,56 +214,52 @@ class LightCurve:
     self.curve[:, self.CURVE_Y_CLEAN] = self.curve[:, self.CURVE_Y]
 
     for filter in self.get_filters():
-      filter()
+      with stage(filter.__name__, self.size):
+        filter()
 
     return self.curve
 
   def noise_sigma_filter(self):
-    n = random.randint(1, 100) / 100
-    errbar = np.abs(np.random.normal(0, n, self.size))
-    noise = np.random.normal(0, errbar)
-    self.curve[:, self.CURVE_SIGMA] = errbar
-    self.curve[:, self.CURVE_Y] = self.curve[:, self.CURVE_Y] + noise
+    self.curve[:, self.CURVE_Y], self.curve[:, self.CURVE_SIGMA] = noise_sigma(self.curve[:, self.CURVE_Y], self.rng)
 
   def patchy_filter(self):
-    remove = []
-    skip = 0
-    for i in range(self.size):
-      if skip > 0:
-        skip -= 1
-      if random.randint(0, 4) < 3 or skip > 0:
-        remove.append(i)
-        continue
-      if random.randint(0, 14) == 0:
-        skip = random.randint(0, 30)
-
-    self.curve = np.delete(self.curve, remove, axis=0)
-    self.size -= len(remove)
+    self.curve = self.curve[patchy_mask(self.size, self.rng)]
+    self.size = len(self.curve)
 
   def dip_filter(self):
-    flux_mean = abs(np.mean(self.curve[:, self.CURVE_Y_CLEAN]))
-    for i in range(random.randint(0,10)):
-      target_index = random.randint(0, self.size-1)
-      multiplier = random.uniform(0.6, 1.2)
-      self.curve[target_index, self.CURVE_Y] -= flux_mean * multiplier
+    self.curve[:, self.CURVE_Y] = dips(self.curve[:, self.CURVE_Y], self.curve[:, self.CURVE_Y_CLEAN], self.rng)
+
+  @classmethod
+  def filter_batch(cls, curves, rng):
+    """ Batch counterpart of apply_filters for curves from generate_batch. Noise is
+    added in place and the keep mask of the removed samples is returned. """
+    curves[:, :, cls.CURVE_Y], curves[:, :, cls.CURVE_SIGMA] = noise_sigma(curves[:, :, cls.CURVE_Y], rng)
+    return patchy_mask(curves.shape[:2], rng)
 
 
 class NonEvent(LightCurve):
-  def __init__(self, m=None, c=None):
+  def __init__(self, m=None, c=None, rng=None):
     self.params = [m, c]
     self.name = 'Non-Event Curve'
-    super().__init__()
+    super().__init__(rng)
 
   def get_filters(self):
     return [self.noise_sigma_filter, self.patchy_filter, self.dip_filter]
 
+  @classmethod
+  def filter_batch(cls, curves, rng):
+    mask = super().filter_batch(curves, rng)
+    curves[:, :, cls.CURVE_Y] = dips(curves[:, :, cls.CURVE_Y], curves[:, :, cls.CURVE_Y_CLEAN], rng, mask)
+    return mask
+
   def generate_params(self):
     if len(self.params) == 2:
       self.m, self.c = self.params
 
-    self.m = self.m or random.uniform(-0.9999999, 1.0000001)
-    self.c = self.c or random.uniform(20, 100)
+    self.m = self.m or self.rng.uniform(-0.9999999, 1.0000001)
+    self.c = self.c or self.rng.uniform(20, 100)
 
+  @timed('generate_curve')
   def generate_curve(self):
     self.curve = np.zeros((self.size, 5))
     self.curve[:, self.CURVE_X] = np.linspace(0, self.size, self.size)
@@ -213,23 +267,36 @@ class NonEvent(LightCurve):
 
     return self.apply_filters()
 
+  @classmethod
+  def draw_params(cls, n, rng):
+    return {
+      'm': rng.uniform(-0.9999999, 1.0000001, n),
+      'c': rng.uniform(20, 100, n)
+    }
+
+  @classmethod
+  def evaluate_batch(cls, params, size):
+    t = np.broadcast_to(np.linspace(0, size, size), (len(params['m']), size))
+    return t, t * params['m'][:, None] + params['c'][:, None]
+
 class MicroLensing(LightCurve):
 
-  def __init__(self, uo=None, tE=None, to=None):
+  def __init__(self, uo=None, tE=None, to=None, rng=None):
     self.params = [uo, tE, to]
     self.name = 'MicroLensing Event Curve'
-    super().__init__()
+    super().__init__(rng)
 
   def generate_params(self):
     if len(self.params) == 3:
       self.uo, self.tE, self.to = self.params
 
-    self.uo = self.uo or random.uniform(0.5, 1.5)
-    self.tE = self.tE or random.uniform(6, 30)
-    self.to = self.to or random.uniform(100, 5000)
+    self.uo = self.uo or self.rng.uniform(0.5, 1.5)
+    self.tE = self.tE or self.rng.uniform(6, 30)
+    self.to = self.to or self.rng.uniform(100, 5000)
 
+  @timed('generate_curve')
   def generate_curve(self):
-    shift = random.uniform(-200, 200)
+    shift = self.rng.uniform(-200, 200)
     self.curve = np.zeros((self.size, 5))
     self.curve[:, self.CURVE_X] = np.linspace(self.to - self.size/2 + shift, self.to + self.size/2 + shift, self.size)
     self.curve[:, self.CURVE_Y] = self.total_magnification(self.rel_lense_motion(self.uo, self.curve[:, self.CURVE_X], self.tE, self.to))
@@ -238,6 +305,21 @@ class MicroLensing(LightCurve):
 
     return self.curve
 
+  @classmethod
+  def draw_params(cls, n, rng):
+    return {
+      'uo': rng.uniform(0.5, 1.5, n),
+      'tE': rng.uniform(6, 30, n),
+      'to': rng.uniform(100, 5000, n),
+      'shift': rng.uniform(-200, 200, n)
+    }
+
+  @classmethod
+  def evaluate_batch(cls, params, size):
+    uo, tE, to = params['uo'][:, None], params['tE'][:, None], params['to'][:, None]
+    start = params['to'] - size/2 + params['shift']
+    t = np.linspace(start, start + size, size, axis=1)
+    return t, cls.total_magnification(cls.rel_lense_motion(uo, t, tE, to))
 
   @staticmethod
   def total_magnification(u):
@@ -252,33 +334,103 @@ class MicroLensing(LightCurve):
 
 class Periodic(LightCurve):
 
-  def __init__(self, skew=None, amp=None, subAmp=None, subFreq=None, mean=None, period=None):
+  def __init__(self, skew=None, amp=None, subAmp=None, subFreq=None, mean=None, period=None, rng=None):
     self.params = [skew, amp, subAmp, subFreq, mean, period]
     self.name = 'Periodic Curve'
-    super().__init__()
+    super().__init__(rng)
 
   def generate_params(self):
     if len(self.params) == 6:
       self.skew, self.amp, self.subAmp, self.subFreq, self.mean, self.period = self.params
 
-    self.skew = self.skew or 1 / random.uniform(1, 10)
-    self.amp = self.amp or random.uniform(1, 30)
-    self.subAmp = self.subAmp or self.amp / random.uniform(3, 15)
-    self.subFreq = self.subFreq or random.uniform(10, 15)
-    self.mean = self.mean or self.amp + random.uniform(150, 1000)
-    self.period = self.period or random.uniform(5, 30)
+    self.skew = self.skew or 1 / self.rng.uniform(1, 10)
+    self.amp = self.amp or self.rng.uniform(1, 30)
+    self.subAmp = self.subAmp or self.amp / self.rng.uniform(3, 15)
+    self.subFreq = self.subFreq or self.rng.uniform(10, 15)
+    self.mean = self.mean or self.amp + self.rng.uniform(150, 1000)
+    self.period = self.period or self.rng.uniform(5, 30)
 
+  @timed('generate_curve')
   def generate_curve(self):
-    phase = random.uniform(0, 700)
+    phase = self.rng.uniform(0, 700)
     self.curve = np.zeros((self.size, 5))
     self.curve[:, self.CURVE_X] = np.linspace(phase, self.size + phase, self.size)
-    t = self.curve[:, self.CURVE_X]
-    self.curve[:, self.CURVE_Y] = self.mean + self.amp * np.sin(self.curve[:, self.CURVE_X] / self.period + np.sin(self.skew * self.curve[:, self.CURVE_X] / self.period)) + self.subAmp * np.sin(self.subFreq * self.curve[:, self.CURVE_X] / self.period)
+    self.curve[:, self.CURVE_Y] = self.periodic_flux(self.curve[:, self.CURVE_X], self.skew, self.amp, self.subAmp, self.subFreq, self.mean, self.period)
 
     self.apply_filters()
 
     return self.curve
 
+  @classmethod
+  def draw_params(cls, n, rng):
+    amp = rng.uniform(1, 30, n)
+    return {
+      'skew': 1 / rng.uniform(1, 10, n),
+      'amp': amp,
+      'subAmp': amp / rng.uniform(3, 15, n),
+      'subFreq': rng.uniform(10, 15, n),
+      'mean': amp + rng.uniform(150, 1000, n),
+      'period': rng.uniform(5, 30, n),
+      'phase': rng.uniform(0, 700, n)
+    }
+
+  @classmethod
+  def evaluate_batch(cls, params, size):
+    t = np.linspace(params['phase'], params['phase'] + size, size, axis=1)
+    p = {name: params[name][:, None] for name in ['skew', 'amp', 'subAmp', 'subFreq', 'mean', 'period']}
+    return t, cls.periodic_flux(t, p['skew'], p['amp'], p['subAmp'], p['subFreq'], p['mean'], p['period'])
+
+  @staticmethod
+  def periodic_flux(t, skew, amp, subAmp, subFreq, mean, period):
+    """ Evaluates the skewed periodic model with a sub-harmonic at times 't'. """
+    return mean + amp * np.sin(t / period + np.sin(skew * t / period)) + subAmp * np.sin(subFreq * t / period)
+
+# Label order of the network outputs, see LightCurve.expected_outputs
+OUTPUT_TYPES = [NonEvent, MicroLensing, Periodic]
+
+@timed('generate_batch')
+def generate_batch(types, n, size=1000, rng=None):
+  """ Generates ``n`` curves drawn uniformly from ``types`` as one ``(n, size, 5)``
+  array. Returns the curves, their labels as indices into OUTPUT_TYPES and a table
+  with one array per parameter name, NaN where the parameter does not apply. """
+  if rng is None:
+    rng = np.random.default_rng()
+
+  choice = rng.integers(0, len(types), n)
+  curves = np.zeros((n, size, 5))
+  labels = np.zeros(n, dtype=int)
+  params = {}
+  for i, curve_type in enumerate(types):
+    index = np.flatnonzero(choice == i)
+    batch, batch_params = curve_type.generate_batch(len(index), size, rng)
+    curves[index] = batch
+    labels[index] = OUTPUT_TYPES.index(curve_type)
+    for name, values in batch_params.items():
+      params.setdefault(name, np.full(n, np.nan))[index] = values
+
+  return curves, labels, params
+
+@timed('filter_batch')
+def filter_batch(curves, labels, rng=None):
+  """ Applies the filters of each curve's class to a batch from generate_batch in
+  place and returns the ``(n, size)`` keep mask. """
+  if rng is None:
+    rng = np.random.default_rng()
+
+  mask = np.zeros(curves.shape[:2], dtype=bool)
+  for i, curve_type in enumerate(OUTPUT_TYPES):
+    index = np.flatnonzero(labels == i)
+    if len(index):
+      batch = curves[index]
+      mask[index] = curve_type.filter_batch(batch, rng)
+      curves[index] = batch
+
+  return mask
+
+def expected_outputs_batch(labels):
+  """ Returns the ``(n, OUTPUT_SIZE)`` one-hot expected outputs for batch labels. """
+  return np.eye(LightCurve.OUTPUT_SIZE)[labels]
+
 if __name__ == '__main__':
   ml = MicroLensing()
   print(ml.calculate_inputs())
\ No newline at end of file
@@ -8,13 +8,18 @@ https://github.com/MichalDanielDobrzanski/DeepLearningPython35
 
 #### Libraries
 # Standard library
+import copy
 import json
-import random
+import os
+import struct
 import sys
 
 # Third-party libraries
 import numpy as np
 
+# Local
+from profiling import timed
+
 
 #### Define the quadratic and cross-entropy cost functions
 
@@ -28,9 +33,12 @@ class QuadraticCost(object):
         return 0.5*np.linalg.norm(a-y)**2
 
     @staticmethod
-    def delta(z, a, y):
-        """Return the error delta from the output layer."""
-        return (a-y) * sigmoid_prime(z)
+    def delta(z, a, y, out=None):
+        """Return the error delta from the output layer, written into
+        ``out`` if it is given."""
+        out = np.subtract(a, y, out=out)
+        out *= sigmoid_prime(z)
+        return out
 
 
 class CrossEntropyCost(object):
@@ -47,19 +55,232 @@ class CrossEntropyCost(object):
         return np.sum(np.nan_to_num(-y*np.log(a)-(1-y)*np.log(1-a)))
 
     @staticmethod
-    def delta(z, a, y):
-        """Return the error delta from the output layer.  Note that the
-        parameter ``z`` is not used by the method.  It is included in
-        the method's parameters in order to make the interface
-        consistent with the delta method for other cost classes.
+    def delta(z, a, y, out=None):
+        """Return the error delta from the output layer, written into
+        ``out`` if it is given.  Note that the parameter ``z`` is not
+        used by the method.  It is included in the method's parameters
+        in order to make the interface consistent with the delta method
+        for other cost classes.
+        """
+        return np.subtract(a, y, out=out)
+
+
+#### Optimizers: how a gradient step changes the weights and biases
+
+class Optimizer(object):
+
+    def __init__(self):
+        """Base class of the optimizers.  ``step`` updates each parameter
+        array in place from its gradient, keeping any per-parameter state
+        (velocities, moving averages) as arrays shaped like the weights
+        and biases.  ``t`` counts the steps taken so far and drives the
+        learning rate schedules."""
+        self.t = 0
+        self.state = None
+
+    def config(self):
+        """Return the hyper-parameters as a JSON-serialisable dict."""
+        return {}
+
+    def step(self, params, grads, eta):
+        """Update every array in ``params`` from the gradient of the same
+        index in ``grads`` with learning rate ``eta``.  The gradients
+        are used as scratch space."""
+        if self.state is None:
+            self.state = [[np.zeros(p.shape, p.dtype) for p in params]
+                          for _ in range(self.num_states)]
+        self.t += 1
+        for i, (p, g) in enumerate(zip(params, grads)):
+            self.update(p, g, [s[i] for s in self.state], eta)
+
+    num_states = 0
+
+
+class GradientDescent(Optimizer):
+
+    def update(self, p, g, state, eta):
+        """Plain gradient descent, p -= eta*g."""
+        g *= eta
+        p -= g
+
+
+class Momentum(Optimizer):
+
+    num_states = 1
+
+    def __init__(self, momentum=0.9, nesterov=False):
+        """Gradient descent with a velocity v = momentum*v - eta*g added
+        to the parameters each step.  With ``nesterov`` the step is
+        taken from the look-ahead point, momentum*v - eta*g."""
+        Optimizer.__init__(self)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def config(self):
+        return {"momentum": self.momentum, "nesterov": self.nesterov}
+
+    def update(self, p, g, state, eta):
+        v, = state
+        g *= eta
+        v *= self.momentum
+        v -= g
+        if self.nesterov:
+            p -= g
+            np.multiply(v, self.momentum, out=g)
+            p += g
+        else:
+            p += v
+
+
+class RMSProp(Optimizer):
+
+    num_states = 1
+
+    def __init__(self, decay=0.9, epsilon=1e-8):
+        """Gradient descent with every component of the gradient divided
+        by the root of a moving average of its square."""
+        Optimizer.__init__(self)
+        self.decay = decay
+        self.epsilon = epsilon
+
+    def config(self):
+        return {"decay": self.decay, "epsilon": self.epsilon}
+
+    def update(self, p, g, state, eta):
+        s, = state
+        s *= self.decay
+        s += (1-self.decay)*np.square(g)
+        g *= eta
+        g /= np.sqrt(s)+self.epsilon
+        p -= g
+
+
+class Adam(Optimizer):
+
+    num_states = 2
+
+    def __init__(self, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        """Adam: RMSProp on a moving average of the gradient, with both
+        averages corrected for their initialisation at zero."""
+        Optimizer.__init__(self)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def config(self):
+        return {"beta1": self.beta1, "beta2": self.beta2, "epsilon": self.epsilon}
+
+    def update(self, p, g, state, eta):
+        m, v = state
+        m *= self.beta1
+        m += (1-self.beta1)*g
+        np.square(g, out=g)
+        v *= self.beta2
+        v += (1-self.beta2)*g
+        np.sqrt(v, out=g)
+        g /= np.sqrt(1-self.beta2**self.t)
+        g += self.epsilon
+        np.divide(m, g, out=g)
+        g *= eta/(1-self.beta1**self.t)
+        p -= g
+
+
+OPTIMIZERS = {"sgd": GradientDescent,
+              "momentum": Momentum,
+              "nesterov": lambda: Momentum(nesterov=True),
+              "rmsprop": RMSProp,
+              "adam": Adam}
+
+def save_optimizer(optimizer, f):
+    """Save the type, hyper-parameters, step count and state arrays of
+    ``optimizer`` to ``f``, a file name or open binary file."""
+    header = {"optimizer": type(optimizer).__name__,
+              "config": optimizer.config(),
+              "t": optimizer.t,
+              "states": 0 if optimizer.state is None else len(optimizer.state)}
+    arrays = {}
+    for i, state in enumerate(optimizer.state or []):
+        for j, a in enumerate(state):
+            arrays["state_%d_%d" % (i, j)] = a
+    np.savez(f, header=json.dumps(header), **arrays)
+
+def load_optimizer(f):
+    """Load an optimizer saved with ``save_optimizer``."""
+    data = np.load(f)
+    header = json.loads(str(data["header"]))
+    optimizer = getattr(sys.modules[__name__], header["optimizer"])(**header["config"])
+    optimizer.t = header["t"]
+    if header["states"]:
+        num_params = sum(1 for key in data.files if key.startswith("state_0_"))
+        optimizer.state = [[data["state_%d_%d" % (i, j)] for j in range(num_params)]
+                           for i in range(header["states"])]
+    return optimizer
+
+
+#### Learning rate schedules: eta as a function of the optimizer's step
+
+class ExponentialDecay(object):
+
+    def __init__(self, eta, half_life):
+        """Learning rate ``eta`` halving every ``half_life`` steps."""
+        self.eta = eta
+        self.half_life = half_life
+
+    def __call__(self, t):
+        return self.eta*0.5**(t/self.half_life)
+
+
+class StepDecay(object):
+
+    def __init__(self, eta, factor, every):
+        """Learning rate ``eta`` multiplied by ``factor`` after every
+        ``every`` steps."""
+        self.eta = eta
+        self.factor = factor
+        self.every = every
+
+    def __call__(self, t):
+        return self.eta*self.factor**(t//self.every)
+
+
+class InverseTimeDecay(object):
+
+    def __init__(self, eta, decay_steps):
+        """Learning rate eta/(1+t/decay_steps)."""
+        self.eta = eta
+        self.decay_steps = decay_steps
+
+    def __call__(self, t):
+        return self.eta/(1+t/self.decay_steps)
+
+
+#### Preallocated training buffers
+
+class Workspace(object):
+
+    def __init__(self, sizes, batch_size, dtype):
+        """Buffers for training on mini batches of up to ``batch_size``
+        samples: per-layer activations, pre-activations (``zs``) and
+        error deltas, stored one sample per row so that the first
+        ``m`` rows of each are contiguous, and gradients shaped like
+        the biases and weights.
         """
-        return (a-y)
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype)
+        self.activations = [np.empty((batch_size, size), dtype) for size in sizes]
+        self.zs = [np.empty((batch_size, size), dtype) for size in sizes[1:]]
+        self.deltas = [np.empty((batch_size, size), dtype) for size in sizes[1:]]
+        self.y = np.empty((batch_size, sizes[-1]), dtype)
+        self.nabla_b = [np.empty((y, 1), dtype) for y in sizes[1:]]
+        self.nabla_w = [np.empty((y, x), dtype)
+                        for x, y in zip(sizes[:-1], sizes[1:])]
 
 
 #### Main Network class
 class Network(object):
 
-    def __init__(self, sizes, cost=CrossEntropyCost):
+    def __init__(self, sizes, cost=CrossEntropyCost, inputs=None, dtype=np.float64,
+                 optimizer=None):
         """The list ``sizes`` contains the number of neurons in the respective
         layers of the network.  For example, if the list was [2, 3, 1]
         then it would be a three-layer network, with the first layer
@@ -67,10 +288,20 @@ class Network(object):
         third layer 1 neuron.  The biases and weights for the network
         are initialized randomly, using
         ``self.default_weight_initializer`` (see docstring for that
-        method).
+        method).  The optional list ``inputs`` names the feature fed to
+        each input neuron; ``None`` means the full default feature set.
+        ``dtype`` is the floating point type of the weights, biases and
+        training buffers, e.g. ``np.float32`` for faster training.
+        ``optimizer`` decides how each gradient step is applied and
+        defaults to plain gradient descent.
         """
         self.num_layers = len(sizes)
         self.sizes = sizes
+        self.inputs = inputs
+        self.feature_version = None
+        self.dtype = np.dtype(dtype)
+        self.workspace = None
+        self.optimizer = optimizer or GradientDescent()
         self.default_weight_initializer()
         self.cost=cost
 
@@ -85,8 +316,8 @@ class Network(object):
         biases are only ever used in computing the outputs from later
         layers.
         """
-        self.biases = [np.random.randn(y, 1) for y in self.sizes[1:]]
-        self.weights = [np.random.randn(y, x)/np.sqrt(x)
+        self.biases = [np.random.randn(y, 1).astype(self.dtype) for y in self.sizes[1:]]
+        self.weights = [(np.random.randn(y, x)/np.sqrt(x)).astype(self.dtype)
                         for x, y in zip(self.sizes[:-1], self.sizes[1:])]
 
     def large_weight_initializer(self):
@@ -102,16 +333,18 @@ class Network(object):
         will usually be better to use the default weight initializer
         instead.
         """
-        self.biases = [np.random.randn(y, 1) for y in self.sizes[1:]]
-        self.weights = [np.random.randn(y, x)
+        self.biases = [np.random.randn(y, 1).astype(self.dtype) for y in self.sizes[1:]]
+        self.weights = [np.random.randn(y, x).astype(self.dtype)
                         for x, y in zip(self.sizes[:-1], self.sizes[1:])]
 
+    @timed()
     def feedforward(self, a):
         """Return the output of the network if ``a`` is input."""
         for b, w in zip(self.biases, self.weights):
             a = sigmoid(np.dot(w, a)+b)
         return a
 
+    @timed()
     def activations(self, a):
         """Return the output of the network if ``a`` is input."""
         activations = [a]
@@ -120,6 +353,24 @@ class Network(object):
             activations.append(a)
         return activations
 
+    @timed()
+    def activations_batch(self, x):
+        """Return the activations of every layer for all the rows of
+        ``x``, an ``(N, sizes[0])`` matrix with one input per row.
+        Each layer is returned as an ``(N, size)`` matrix, so the
+        whole batch costs one matrix product per layer."""
+        activations = [x]
+        for b, w in zip(self.biases, self.weights):
+            x = sigmoid(np.dot(x, w.transpose())+b.transpose())
+            activations.append(x)
+        return activations
+
+    def predict_batch(self, x):
+        """Return the ``(N, sizes[-1])`` output activations for the
+        ``(N, sizes[0])`` inputs ``x``."""
+        return self.activations_batch(x)[-1]
+
+    @timed()
     def SGD(self, training_data, epochs, mini_batch_size, eta,
             lmbda = 0.0,
             evaluation_data=None,
@@ -132,7 +383,9 @@ class Network(object):
         descent.  The ``training_data`` is a list of tuples ``(x, y)``
         representing the training inputs and the desired outputs.  The
         other non-optional parameters are self-explanatory, as is the
-        regularization parameter ``lmbda``.  The method also accepts
+        regularization parameter ``lmbda``.  The learning rate ``eta``
+        is either a number or a schedule, a function of the optimizer's
+        step count such as ``ExponentialDecay``.  The method also accepts
         ``evaluation_data``, usually either the validation or test
         data.  We can monitor the cost and accuracy on either the
         evaluation data or the training data, by setting the
@@ -152,6 +405,8 @@ class Network(object):
 
         training_data = list(training_data)
         n = len(training_data)
+        x = np.concatenate([x.transpose() for x, y in training_data], dtype=self.dtype)
+        y = np.concatenate([y.transpose() for x, y in training_data], dtype=self.dtype)
 
         if evaluation_data:
             evaluation_data = list(evaluation_data)
@@ -164,13 +419,10 @@ class Network(object):
         evaluation_cost, evaluation_accuracy = [], []
         training_cost, training_accuracy = [], []
         for j in range(epochs):
-            random.shuffle(training_data)
-            mini_batches = [
-                training_data[k:k+mini_batch_size]
-                for k in range(0, n, mini_batch_size)]
-            for mini_batch in mini_batches:
-                self.update_mini_batch(
-                    mini_batch, eta, lmbda, len(training_data))
+            order = np.random.permutation(n)
+            for k in range(0, n, mini_batch_size):
+                self.update_mini_batch_rows(
+                    x, y, order[k:k+mini_batch_size], eta, lmbda, n)
 
             print("Epoch %s training complete" % j)
 
@@ -207,23 +459,126 @@ class Network(object):
         return evaluation_cost, evaluation_accuracy, \
             training_cost, training_accuracy
 
+    @timed()
+    def train_rows(self, x, y, epochs, mini_batch_size, eta, lmbda=0.0):
+        """Train as ``SGD`` does, without monitoring, on the inputs ``x``
+        and desired outputs ``y`` given as matrices with one sample per
+        row.  No per-sample arrays are built and, if they are already
+        in the network's dtype, the matrices are used without a copy.
+        """
+        x = np.asarray(x, dtype=self.dtype)
+        y = np.asarray(y, dtype=self.dtype)
+        n = len(x)
+        for j in range(epochs):
+            order = np.random.permutation(n)
+            for k in range(0, n, mini_batch_size):
+                self.update_mini_batch_rows(
+                    x, y, order[k:k+mini_batch_size], eta, lmbda, n)
+
     def update_mini_batch(self, mini_batch, eta, lmbda, n):
         """Update the network's weights and biases by applying gradient
         descent using backpropagation to a single mini batch.  The
         ``mini_batch`` is a list of tuples ``(x, y)``, ``eta`` is the
-        learning rate, ``lmbda`` is the regularization parameter, and
+        learning rate or schedule, ``lmbda`` is the regularization parameter, and
         ``n`` is the total size of the training data set.
         """
-        nabla_b = [np.zeros(b.shape) for b in self.biases]
-        nabla_w = [np.zeros(w.shape) for w in self.weights]
-        for x, y in mini_batch:
-            delta_nabla_b, delta_nabla_w = self.backprop(x, y)
-            nabla_b = [nb+dnb for nb, dnb in zip(nabla_b, delta_nabla_b)]
-            nabla_w = [nw+dnw for nw, dnw in zip(nabla_w, delta_nabla_w)]
-        self.weights = [(1-eta*(lmbda/n))*w-(eta/len(mini_batch))*nw
-                        for w, nw in zip(self.weights, nabla_w)]
-        self.biases = [b-(eta/len(mini_batch))*nb
-                       for b, nb in zip(self.biases, nabla_b)]
+        x = np.concatenate([x.transpose() for x, y in mini_batch], dtype=self.dtype)
+        y = np.concatenate([y.transpose() for x, y in mini_batch], dtype=self.dtype)
+        self.update_mini_batch_rows(x, y, np.arange(len(mini_batch)), eta, lmbda, n)
+
+    @timed('update_mini_batch')
+    def update_mini_batch_rows(self, x, y, index, eta, lmbda, n):
+        """Apply ``update_mini_batch`` to the mini batch made of the
+        rows ``index`` of the inputs ``x`` and desired outputs ``y``,
+        which hold one sample per row in the network's dtype.  The
+        samples are gathered straight into the training workspace and
+        the weights and biases are updated in place by the optimizer,
+        after the weight decay of the L2 regularization.
+        """
+        m = len(index)
+        if callable(eta):
+            eta = eta(self.optimizer.t)
+        ws = self.training_workspace(m)
+        np.take(x, index, axis=0, out=ws.activations[0][:m])
+        np.take(y, index, axis=0, out=ws.y[:m])
+        self.backprop_workspace(ws, m)
+        for nw in ws.nabla_w:
+            nw /= m
+        for nb in ws.nabla_b:
+            nb /= m
+        self.apply_gradients(ws.nabla_b, ws.nabla_w, eta, lmbda, n)
+
+    def apply_gradients(self, nabla_b, nabla_w, eta, lmbda, n):
+        """Update the weights and biases in place from the gradients
+        ``nabla_b`` and ``nabla_w`` averaged over a mini batch: the
+        weight decay of the L2 regularization followed by a step of the
+        optimizer with learning rate ``eta``, a number.  The gradient
+        arrays are overwritten."""
+        for w in self.weights:
+            w *= 1-eta*(lmbda/n)
+        self.optimizer.step(self.weights + self.biases, nabla_w + nabla_b, eta)
+
+    def training_workspace(self, batch_size):
+        """Return a ``Workspace`` for mini batches of ``batch_size``
+        samples, reusing the previous one whenever it is big enough."""
+        if self.workspace is None or self.workspace.batch_size < batch_size \
+                or self.workspace.dtype != self.dtype:
+            self.workspace = Workspace(self.sizes, batch_size, self.dtype)
+        return self.workspace
+
+    def backprop_workspace(self, ws, m):
+        """Compute the gradients of ``backprop_batch`` for the first ``m``
+        samples held in the workspace ``ws``, writing them into
+        ``ws.nabla_b`` and ``ws.nabla_w`` without allocating arrays.
+        Once a layer's pre-activations are used up their buffer holds
+        its sigmoid derivative, a*(1-a)."""
+        activation = ws.activations[0][:m]
+        for l, (b, w) in enumerate(zip(self.biases, self.weights)):
+            z = ws.zs[l][:m]
+            np.dot(activation, w.transpose(), out=z)
+            z += b.transpose()
+            activation = sigmoid(z, out=ws.activations[l+1][:m])
+        # backward pass, see backprop for the indexing of l
+        delta = (self.cost).delta(ws.zs[-1][:m], activation, ws.y[:m], out=ws.deltas[-1][:m])
+        np.sum(delta, axis=0, out=ws.nabla_b[-1].reshape(-1))
+        np.dot(delta.transpose(), ws.activations[-2][:m], out=ws.nabla_w[-1])
+        for l in range(2, self.num_layers):
+            a = ws.activations[-l][:m]
+            sp = np.subtract(1, a, out=ws.zs[-l][:m])
+            sp *= a
+            delta = np.dot(delta, self.weights[-l+1], out=ws.deltas[-l][:m])
+            delta *= sp
+            np.sum(delta, axis=0, out=ws.nabla_b[-l].reshape(-1))
+            np.dot(delta.transpose(), ws.activations[-l-1][:m], out=ws.nabla_w[-l])
+
+    def backprop_batch(self, x, y):
+        """Return a tuple ``(nabla_b, nabla_w)`` with the gradients of
+        ``backprop`` summed over a whole mini batch.  The columns of
+        ``x`` and ``y`` are the inputs and desired outputs of the
+        samples, so every layer is a single matrix product rather
+        than one per sample."""
+        nabla_b = [None for b in self.biases]
+        nabla_w = [None for w in self.weights]
+        # feedforward
+        activation = x
+        activations = [x]
+        zs = []
+        for b, w in zip(self.biases, self.weights):
+            z = np.dot(w, activation)+b
+            zs.append(z)
+            activation = sigmoid(z)
+            activations.append(activation)
+        # backward pass, see backprop for the indexing of l
+        delta = (self.cost).delta(zs[-1], activations[-1], y)
+        nabla_b[-1] = delta.sum(axis=1, keepdims=True)
+        nabla_w[-1] = np.dot(delta, activations[-2].transpose())
+        for l in range(2, self.num_layers):
+            z = zs[-l]
+            sp = sigmoid_prime(z)
+            delta = np.dot(self.weights[-l+1].transpose(), delta) * sp
+            nabla_b[-l] = delta.sum(axis=1, keepdims=True)
+            nabla_w[-l] = np.dot(delta, activations[-l-1].transpose())
+        return (nabla_b, nabla_w)
 
     def backprop(self, x, y):
         """Return a tuple ``(nabla_b, nabla_w)`` representing the
@@ -280,14 +635,14 @@ class Network(object):
         representations can be found in
         mnist_loader.load_data_wrapper.
         """
+        x = np.hstack([x for (x, y) in data]).transpose()
+        predicted = np.argmax(self.predict_batch(x), axis=1)
         if convert:
-            results = [(np.argmax(self.feedforward(x)), np.argmax(y))
-                       for (x, y) in data]
+            expected = np.argmax(np.hstack([y for (x, y) in data]), axis=0)
         else:
-            results = [(np.argmax(self.feedforward(x)), y)
-                        for (x, y) in data]
+            expected = np.array([y for (x, y) in data])
 
-        result_accuracy = sum(int(x == y) for (x, y) in results)
+        result_accuracy = int(np.sum(predicted == expected))
         return result_accuracy
 
     def total_cost(self, data, lmbda, convert=False):
@@ -296,39 +651,199 @@ class Network(object):
         training data (the usual case), and to True if the data set is
         the validation or test data.  See comments on the similar (but
         reversed) convention for the ``accuracy`` method, above.
+        The regularization term is computed once and has the value the
+        former per-sample loop accumulated, 0.5*lmbda*sum(|w|**2).
         """
-        cost = 0.0
-        for x, y in data:
-            a = self.feedforward(x)
-            if convert: y = vectorized_result(y)
-            cost += self.cost.fn(a, y)/len(data)
-            cost += 0.5*(lmbda/len(data))*sum(np.linalg.norm(w)**2 for w in self.weights) # '**' - to the power of.
+        x = np.hstack([x for (x, y) in data]).transpose()
+        a = self.predict_batch(x).transpose()
+        if convert:
+            y = np.eye(self.sizes[-1])[[y for (x, y) in data]].transpose()
+        else:
+            y = np.hstack([y for (x, y) in data])
+        cost = self.cost.fn(a, y)/len(data)
+        cost += 0.5*lmbda*sum(np.linalg.norm(w)**2 for w in self.weights) # '**' - to the power of.
         return cost
 
+    def copy(self):
+        """Return a copy of the network that shares no weights, biases or
+        optimizer state with it and has no training workspace.  Unlike constructing a
+        new Network, this draws nothing from the random generator."""
+        net = copy.copy(self)
+        net.weights = [w.copy() for w in self.weights]
+        net.biases = [b.copy() for b in self.biases]
+        net.workspace = None
+        net.optimizer = copy.deepcopy(self.optimizer)
+        return net
+
     def save(self, filename):
         """Save the neural network to the file ``filename``."""
         data = {"sizes": self.sizes,
                 "weights": [w.tolist() for w in self.weights],
                 "biases": [b.tolist() for b in self.biases],
-                "cost": str(self.cost.__name__)}
+                "cost": str(self.cost.__name__),
+                "dtype": self.dtype.name}
+        if self.inputs is not None:
+            data["inputs"] = self.inputs
+        if self.feature_version is not None:
+            data["feature_version"] = self.feature_version
         f = open(filename, "w")
         json.dump(data, f)
         f.close()
 
+    def save_binary(self, filename):
+        """Save the neural network to ``filename`` in the binary format
+        read by ``load_binary``: the magic ``BINARY_MAGIC``, the length
+        of a JSON header as a little-endian uint32, the header and then
+        every weight and bias array, layer by layer, contiguously and
+        aligned to ``BINARY_ALIGN`` bytes."""
+        arrays = []
+        for w, b in zip(self.weights, self.biases):
+            arrays += [w, b]
+        layout, offset = [], 0
+        for a in arrays:
+            layout.append({"shape": list(a.shape), "offset": offset})
+            offset += a.size
+        header = {"format_version": BINARY_VERSION,
+                  "sizes": self.sizes,
+                  "cost": str(self.cost.__name__),
+                  "dtype": self.dtype.str,
+                  "feature_version": self.feature_version,
+                  "inputs": self.inputs,
+                  "arrays": layout}
+        header = json.dumps(header).encode()
+        start = len(BINARY_MAGIC) + 4 + len(header)
+        header += b" " * (-start % BINARY_ALIGN)
+        f = open(filename, "wb")
+        f.write(BINARY_MAGIC + struct.pack("<I", len(header)) + header)
+        for a in arrays:
+            f.write(np.ascontiguousarray(a, dtype=self.dtype).tobytes())
+        f.close()
+
+#### Ensembles of networks sharing one architecture
+class Ensemble(object):
+
+    def __init__(self, networks):
+        """Stack the weights and biases of ``networks`` into one
+        ``(M, y, x)`` weight and one ``(M, 1, y)`` bias array per layer,
+        so that all ``M`` models are evaluated together.  The networks
+        must agree in their sizes, cost and named inputs."""
+        first = networks[0]
+        for net in networks[1:]:
+            if net.sizes != first.sizes or net.cost is not first.cost \
+                    or net.inputs != first.inputs:
+                raise ValueError("Ensemble networks must share sizes, cost and inputs")
+        self.sizes = first.sizes
+        self.cost = first.cost
+        self.inputs = first.inputs
+        self.dtype = np.result_type(*[net.dtype for net in networks])
+        self.weights = [np.stack([net.weights[l] for net in networks]).astype(self.dtype)
+                        for l in range(len(first.weights))]
+        self.biases = [np.stack([net.biases[l].transpose() for net in networks]).astype(self.dtype)
+                       for l in range(len(first.biases))]
+
+    def __len__(self):
+        return len(self.weights[0])
+
+    def predict_batch(self, x):
+        """Return the ``(M, N, sizes[-1])`` output activations of every
+        model for the ``(N, sizes[0])`` inputs ``x``.  Each layer is a
+        single batched matrix product over all the models."""
+        a = x
+        for b, w in zip(self.biases, self.weights):
+            a = sigmoid(np.matmul(a, w.transpose(0, 2, 1))+b)
+        return a
+
+def mean_outputs(outputs):
+    """Average the ``(M, N, K)`` outputs of an ensemble over the models."""
+    return outputs.mean(axis=0)
+
+def vote_fractions(outputs):
+    """Return the ``(N, K)`` fraction of the models in an ensemble whose
+    highest output is each class.  A model whose highest output is
+    shared by several classes splits its vote equally between them."""
+    top = outputs == outputs.max(axis=2, keepdims=True)
+    return np.mean(top / top.sum(axis=2, keepdims=True), axis=0)
+
+def majority_vote(outputs):
+    """Return the ``(N,)`` classes with the most votes in an ensemble.
+    A tie goes to the tied class with the highest mean output rather
+    than to the lowest class index, as ``np.argmax`` would."""
+    votes = vote_fractions(outputs)
+    tied = votes >= votes.max(axis=1, keepdims=True) - 1e-12
+    return np.argmax(np.where(tied, mean_outputs(outputs), -np.inf), axis=1)
+
 #### Loading a Network
+BINARY_MAGIC = b"NNMB"
+BINARY_VERSION = 1
+BINARY_ALIGN = 64
+
 def load(filename):
-    """Load a neural network from the file ``filename``.  Returns an
-    instance of Network.
+    """Load a neural network from the file ``filename``, written by
+    either ``save`` or ``save_binary``.  Returns an instance of Network.
     """
+    f = open(filename, "rb")
+    magic = f.read(len(BINARY_MAGIC))
+    f.close()
+    if magic == BINARY_MAGIC:
+        return load_binary(filename)
+
     f = open(filename, "r")
     data = json.load(f)
     f.close()
     cost = getattr(sys.modules[__name__], data["cost"])
-    net = Network(data["sizes"], cost=cost)
-    net.weights = [np.array(w) for w in data["weights"]]
-    net.biases = [np.array(b) for b in data["biases"]]
+    dtype = np.dtype(data.get("dtype", "float64"))
+    net = Network(data["sizes"], cost=cost, inputs=data.get("inputs"), dtype=dtype)
+    net.weights = [np.array(w, dtype=dtype) for w in data["weights"]]
+    net.biases = [np.array(b, dtype=dtype) for b in data["biases"]]
+    net.feature_version = data.get("feature_version")
+    return net
+
+def load_binary(filename, mmap=True):
+    """Load a neural network saved with ``save_binary``.  With ``mmap``
+    the weights and biases are copy-on-write views of a memory map of
+    the file, so nothing is parsed or copied until it is used and
+    changes are never written back.
+    """
+    f = open(filename, "rb")
+    if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        f.close()
+        raise ValueError("{} is not a binary network file".format(filename))
+    header_size = struct.unpack("<I", f.read(4))[0]
+    header = json.loads(f.read(header_size).decode())
+    f.close()
+    if header["format_version"] > BINARY_VERSION:
+        raise ValueError("{} has unsupported format version {}".format(
+            filename, header["format_version"]))
+
+    dtype = np.dtype(header["dtype"])
+    offset = len(BINARY_MAGIC) + 4 + header_size
+    if mmap:
+        data = np.memmap(filename, dtype=dtype, mode="c", offset=offset)
+    else:
+        data = np.fromfile(filename, dtype=dtype, offset=offset)
+    arrays = [data[a["offset"]:a["offset"]+int(np.prod(a["shape"]))].reshape(a["shape"])
+              for a in header["arrays"]]
+
+    cost = getattr(sys.modules[__name__], header["cost"])
+    net = Network(header["sizes"], cost=cost, inputs=header["inputs"], dtype=dtype)
+    net.weights = arrays[0::2]
+    net.biases = arrays[1::2]
+    net.feature_version = header["feature_version"]
     return net
 
+def load_ensemble(filenames):
+    """Load the networks in ``filenames`` as an ``Ensemble``."""
+    return Ensemble([load(filename) for filename in filenames])
+
+def convert(filename, output=None):
+    """Convert a network saved with ``save`` to the binary format, by
+    default next to it with the extension ``.nnb``.  Returns the name
+    of the written file."""
+    if output is None:
+        output = os.path.splitext(filename)[0] + ".nnb"
+    load(filename).save_binary(output)
+    return output
+
 #### Miscellaneous functions
 def vectorized_result(j):
     """Return a 10-dimensional unit vector with a 1.0 in the j'th position
@@ -339,10 +854,28 @@ def vectorized_result(j):
     e[j] = 1.0
     return e
 
-def sigmoid(z):
-    """The sigmoid function."""
-    return 1.0/(1.0+np.exp(-z))
+def sigmoid(z, out=None):
+    """The sigmoid function.  If ``out``, a preallocated float array of
+    the shape of ``z``, is given the result is written into it without
+    allocating.  Large negative ``z`` overflow ``exp`` to infinity,
+    which gives the correct limit of 0, so that warning is silenced."""
+    with np.errstate(over='ignore'):
+        if out is None:
+            return 1.0/(1.0+np.exp(-z))
+        np.negative(z, out=out)
+        np.exp(out, out=out)
+        out += 1.0
+        return np.reciprocal(out, out=out)
 
 def sigmoid_prime(z):
     """Derivative of the sigmoid function."""
-    return sigmoid(z)*(1-sigmoid(z))
\ No newline at end of file
+    s = sigmoid(z)
+    return s*(1-s)
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print("Usage: python network.py NETWORK_FILE.json [...]")
+        exit()
+
+    for filename in sys.argv[1:]:
+        print("{} -> {}".format(filename, convert(filename)))
@@ -0,0 +1,225 @@
+"""
+Data-parallel training. The weights and biases live in shared memory and every
+worker process generates its own curves, so both generation and backpropagation
+scale with the number of workers.
+
+In 'sync' mode every mini batch is split between the workers, which compute the
+summed gradients of their shares; the parent adds them up, divides by the rows of
+all the shares and takes the step with the network's optimizer. This is the
+update of training in one process on the mini batch made of the shares, even
+when they differ in size. That mini batch holds ``workers`` times
+``mini_batch_size // workers`` rows, so ``mini_batch_size`` is rounded down to a
+multiple of the number of workers. In 'hogwild' mode the workers train on mini batches of their own
+curves and update the shared weights themselves, without locks, each with its
+own copy of the optimizer.
+
+Run ``python parallel.py --workers 1 2 4 8`` to measure the scaling efficiency.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+import multiprocessing as mp
+from threading import BrokenBarrierError
+from network import Network
+from lightcurve import LightCurve, MicroLensing, NonEvent, Periodic, generate_batch, filter_batch, expected_outputs_batch
+from features import batch_inputs
+
+MODES = ['sync', 'hogwild']
+
+# Per-worker counters: curves generated, samples trained on, correct predictions
+GENERATED, TRAINED, CORRECT = range(3)
+
+# Seconds between checks on the workers while waiting for them in hogwild mode
+POLL_INTERVAL = 0.01
+
+def parameter_count(sizes):
+  return sum(x * y + y for x, y in zip(sizes[:-1], sizes[1:]))
+
+def parameter_views(flat, sizes):
+  """ Splits the flat array ``flat`` into the weights and biases of a network of
+  ``sizes``, as views. """
+  weights, biases, offset = [], [], 0
+  for x, y in zip(sizes[:-1], sizes[1:]):
+    weights.append(flat[offset:offset + x * y].reshape(y, x))
+    offset += x * y
+    biases.append(flat[offset:offset + y].reshape(y, 1))
+    offset += y
+  return weights, biases
+
+def shared_array(dtype, shape):
+  """ Returns a zeroed RawArray large enough for an array of ``dtype`` and ``shape``
+  and the array viewing it. """
+  raw = mp.RawArray('b', int(np.prod(shape)) * np.dtype(dtype).itemsize)
+  return raw, np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+def count_correct(ws, m):
+  """ Correct predictions among the first ``m`` samples of the workspace ``ws``,
+  from the outputs of its last forward pass. """
+  return int(np.sum(np.argmax(ws.activations[-1][:m], axis=1) == np.argmax(ws.y[:m], axis=1)))
+
+class ParallelTrainer:
+
+  def __init__(self, nn, workers, types, samples, mini_batch_size, epochs, eta, lmbda=0.0, mode='sync', seeds=None):
+    """ Trains ``nn`` with ``workers`` processes. Each ``step`` trains on
+    ``samples`` new curves, ``epochs`` times over in mini batches of
+    ``mini_batch_size``, like SGD on a list of ``samples`` generated curves. From
+    here on the weights and biases of ``nn`` are views of the shared memory.
+    ``seeds`` holds a seed per worker, by default spawned from fresh entropy. """
+    if mode not in MODES:
+      raise ValueError("Unknown mode " + repr(mode))
+
+    self.nn = nn
+    self.workers = workers
+    self.mode = mode
+    self.eta = eta
+    self.lmbda = lmbda
+    self.samples = samples
+    local_samples = max(samples // workers, 1)
+    if mode == 'sync':
+      local_batch = max(mini_batch_size // workers, 1)
+    else:
+      local_batch = min(mini_batch_size, local_samples)
+    self.steps = epochs * -(-local_samples // local_batch)
+
+    size = parameter_count(nn.sizes)
+    params_raw, params = shared_array(nn.dtype, size)
+    weights, biases = parameter_views(params, nn.sizes)
+    for shared, array in zip(weights + biases, nn.weights + nn.biases):
+      shared[...] = array
+    nn.weights, nn.biases = weights, biases
+
+    grads_raw, self.grads = shared_array(nn.dtype, (workers, size))
+    rows_raw, self.rows = shared_array(np.int64, workers)
+    self.mean = np.empty(size, dtype=nn.dtype)
+    self.mean_w, self.mean_b = parameter_views(self.mean, nn.sizes)
+    counters_raw, self.counters = shared_array(np.int64, (workers, 3))
+    self.reported = np.zeros(3, dtype=np.int64)
+
+    self.barrier = mp.Barrier(workers + 1) if mode == 'sync' else None
+    self.stop = mp.Event()
+    seeds = seeds or np.random.SeedSequence().spawn(workers)
+    template = nn.copy()
+    self.processes = [mp.Process(target=worker_process, daemon=True,
+                                 args=(i, template, params_raw, grads_raw, rows_raw, counters_raw, self.barrier, self.stop,
+                                       types, local_samples, local_batch, epochs, eta, lmbda, samples, seeds[i]))
+                      for i in range(workers)]
+    for process in self.processes:
+      process.start()
+    self.start_time = time.time()
+
+  def step(self):
+    """ Trains on ``samples`` new curves. Returns the number of curves generated
+    and the fraction of training samples the network classified correctly
+    before each update. """
+    if self.mode == 'sync':
+      for _ in range(self.steps):
+        self.barrier.wait()
+        self.barrier.wait()
+        np.sum(self.grads, axis=0, out=self.mean)
+        self.mean /= self.rows.sum()
+        eta = self.eta(self.nn.optimizer.t) if callable(self.eta) else self.eta
+        self.nn.apply_gradients(self.mean_b, self.mean_w, eta, self.lmbda, self.samples)
+    else:
+      target = self.reported[GENERATED] + self.samples
+      while self.counters[:, GENERATED].sum() < target:
+        if not all(process.is_alive() for process in self.processes):
+          raise RuntimeError("A training worker exited")
+        time.sleep(POLL_INTERVAL)
+
+    totals = self.counters.sum(axis=0)
+    generated, trained, correct = totals - self.reported
+    self.reported = totals
+    return int(generated), correct / max(trained, 1)
+
+  def throughput(self):
+    """ Curves generated and trained on per second since the workers started. """
+    return self.reported[GENERATED] / (time.time() - self.start_time)
+
+  def close(self):
+    self.stop.set()
+    if self.barrier is not None:
+      self.barrier.abort()
+    for process in self.processes:
+      process.join(1)
+      if process.is_alive():
+        process.terminate()
+
+def worker_process(index, nn, params_raw, grads_raw, rows_raw, counters_raw, barrier, stop,
+                   types, local_samples, local_batch, epochs, eta, lmbda, samples, seed):
+  """ Generates ``local_samples`` curves at a time and trains on them. In sync
+  mode (with a ``barrier``) every mini batch waits for the parent: the gradient
+  summed over this worker's share goes to its row of the shared gradients and the
+  size of the share to its entry of the shared row counts, which the parent reads
+  once every worker has passed the barrier again. """
+  params = np.frombuffer(params_raw, dtype=nn.dtype)
+  nn.weights, nn.biases = parameter_views(params, nn.sizes)
+  grad = np.frombuffer(grads_raw, dtype=nn.dtype).reshape(-1, len(params))[index]
+  grad_w, grad_b = parameter_views(grad, nn.sizes)
+  rows_done = np.frombuffer(rows_raw, dtype=np.int64)
+  counters = np.frombuffer(counters_raw, dtype=np.int64).reshape(-1, 3)[index]
+  rng = np.random.default_rng(seed)
+
+  try:
+    while not stop.is_set():
+      curves, labels, _ = generate_batch(types, local_samples, rng=rng)
+      mask = filter_batch(curves, labels, rng)
+      x = batch_inputs(curves, mask).astype(nn.dtype)
+      y = expected_outputs_batch(labels).astype(nn.dtype)
+      counters[GENERATED] += len(x)
+
+      for _ in range(epochs):
+        order = rng.permutation(len(x))
+        for k in range(0, len(x), local_batch):
+          rows = order[k:k + local_batch]
+          m = len(rows)
+          if barrier is None:
+            nn.update_mini_batch_rows(x, y, rows, eta, lmbda, samples)
+            ws = nn.workspace
+          else:
+            barrier.wait()
+            ws = nn.training_workspace(m)
+            np.take(x, rows, axis=0, out=ws.activations[0][:m])
+            np.take(y, rows, axis=0, out=ws.y[:m])
+            nn.backprop_workspace(ws, m)
+            for nw, gw in zip(ws.nabla_w, grad_w):
+              gw[...] = nw
+            for nb, gb in zip(ws.nabla_b, grad_b):
+              gb[...] = nb
+            rows_done[index] = m
+          counters[TRAINED] += m
+          counters[CORRECT] += count_correct(ws, m)
+          if barrier is not None:
+            barrier.wait()
+  except BrokenBarrierError:
+    pass
+
+def benchmark(worker_counts, iterations, mode, samples=1000, mini_batch_size=250, epochs=10, eta=0.35):
+  """ Prints the throughput of ParallelTrainer for each number of workers, and
+  its speedup and efficiency relative to the first count. """
+  types = [MicroLensing, NonEvent, Periodic]
+  base = None
+  print("Workers, Curves/s, Speedup, Efficiency")
+  for workers in worker_counts:
+    nn = Network([LightCurve.INPUT_SIZE, 8, 8, LightCurve.OUTPUT_SIZE])
+    trainer = ParallelTrainer(nn, workers, types, samples, mini_batch_size, epochs, eta, mode=mode)
+    trainer.step()
+    start, generated = time.perf_counter(), 0
+    for _ in range(iterations):
+      generated += trainer.step()[0]
+    rate = generated / (time.perf_counter() - start)
+    trainer.close()
+
+    if base is None:
+      base = rate / workers
+    print("{}, {:.1f}, {:.2f}, {:.1f}%".format(workers, rate, rate / base, 100 * rate / (base * workers)))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Measure the scaling of data-parallel training.")
+  parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="worker counts to compare")
+  parser.add_argument('--iterations', type=int, default=5, help="training iterations timed per count")
+  parser.add_argument('--mode', choices=MODES, default='sync')
+  args = parser.parse_args()
+  benchmark(args.workers, args.iterations, args.mode)
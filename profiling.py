@@ -0,0 +1,163 @@
+"""
+Opt-in timing of the hot paths: curve generation, filters, features and the
+network. Set NN_PROFILE=1 in the environment to enable it; it is read once at
+import, so worker processes forked by train.py inherit the setting. When
+disabled, ``timed`` returns the function unchanged and ``stage`` a shared no-op.
+
+Each process records call counts, cumulative time, a bounded sample of call
+durations for percentiles and the array sizes seen per stage. Workers send
+``snapshot(reset=True)`` to the parent, which ``merge``s them and exports the
+totals with ``export``.
+"""
+
+import os
+import csv
+import json
+import time
+import random
+import functools
+import numpy as np
+
+ENABLED = os.environ.get('NN_PROFILE', '') not in ('', '0')
+
+# Durations kept per stage for the percentiles, as a uniform reservoir sample
+SAMPLE_LIMIT = 10000
+
+PERCENTILES = [50, 90, 99]
+
+_stats = {}
+_sampler = random.Random()
+
+class _NullStage:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+  def __init__(self, name, size):
+    self.name = name
+    self.size = size
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    record(self.name, time.perf_counter() - self.start, self.size)
+    return False
+
+def stage(name, size=None):
+  """ Context manager timing its body as stage ``name``, optionally recording the
+  array size it worked on. """
+  return _Stage(name, size) if ENABLED else _NULL_STAGE
+
+def timed(name=None):
+  """ Decorator timing every call as stage ``name`` (the function name by default)
+  and recording the length of array results. """
+  def decorate(fn):
+    if not ENABLED:
+      return fn
+
+    stage_name = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      start = time.perf_counter()
+      result = fn(*args, **kwargs)
+      shape = np.shape(result) if isinstance(result, np.ndarray) else ()
+      record(stage_name, time.perf_counter() - start, shape[0] if shape else None)
+      return result
+    return wrapper
+  return decorate
+
+def record(name, seconds, size=None):
+  stats = _stats.get(name)
+  if stats is None:
+    stats = _stats[name] = {'count': 0, 'total': 0.0, 'samples': [], 'size_count': 0, 'size_total': 0, 'size_max': 0}
+
+  stats['count'] += 1
+  stats['total'] += seconds
+  if len(stats['samples']) < SAMPLE_LIMIT:
+    stats['samples'].append(seconds)
+  else:
+    slot = _sampler.randrange(stats['count'])
+    if slot < SAMPLE_LIMIT:
+      stats['samples'][slot] = seconds
+
+  if size is not None:
+    stats['size_count'] += 1
+    stats['size_total'] += size
+    stats['size_max'] = max(stats['size_max'], size)
+
+def snapshot(reset=False):
+  """ Returns the raw statistics of this process as a picklable dict. """
+  global _stats
+  current = _stats
+  if reset:
+    _stats = {}
+  else:
+    current = {name: dict(stats, samples=list(stats['samples'])) for name, stats in current.items()}
+  return current
+
+def merge(other):
+  """ Adds the statistics of a snapshot from another process to this one. """
+  for name, theirs in other.items():
+    ours = _stats.get(name)
+    if ours is None:
+      _stats[name] = dict(theirs, samples=list(theirs['samples']))
+      continue
+
+    ours['samples'] = merge_samples(ours['samples'], ours['count'], theirs['samples'], theirs['count'])
+    for key in ['count', 'total', 'size_count', 'size_total']:
+      ours[key] += theirs[key]
+    ours['size_max'] = max(ours['size_max'], theirs['size_max'])
+
+def merge_samples(ours, our_count, theirs, their_count):
+  """ A uniform sample of at most SAMPLE_LIMIT durations from the union of two
+  reservoirs, uniform samples of ``our_count`` and ``their_count`` durations. Each
+  draw comes from one side with probability proportional to the durations it has
+  left, so a side contributes in proportion to its count, not its sample size. """
+  if our_count + their_count <= SAMPLE_LIMIT:
+    return ours + theirs
+
+  take, ours_left, theirs_left = 0, our_count, their_count
+  for _ in range(SAMPLE_LIMIT):
+    if _sampler.random() * (ours_left + theirs_left) < ours_left:
+      take += 1
+      ours_left -= 1
+    else:
+      theirs_left -= 1
+  return _sampler.sample(ours, take) + _sampler.sample(theirs, SAMPLE_LIMIT - take)
+
+def reset():
+  _stats.clear()
+
+def summary():
+  """ Returns one row per stage with counts, cumulative and mean time, duration
+  percentiles (in seconds) and array sizes, slowest cumulative stage first. """
+  rows = []
+  for name, stats in _stats.items():
+    row = {'stage': name, 'count': stats['count'], 'total': stats['total'], 'mean': stats['total'] / stats['count']}
+    for p, value in zip(PERCENTILES, np.percentile(stats['samples'], PERCENTILES)):
+      row['p%d' % p] = float(value)
+    row['mean_size'] = stats['size_total'] / stats['size_count'] if stats['size_count'] else None
+    row['max_size'] = stats['size_max'] if stats['size_count'] else None
+    rows.append(row)
+
+  return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+def export(basename):
+  """ Writes the summary to ``basename``.json and ``basename``.csv. """
+  rows = summary()
+  with open(basename + '.json', 'w') as f:
+    json.dump(rows, f, indent=2)
+
+  with open(basename + '.csv', 'w', newline='') as f:
+    fields = ['stage', 'count', 'total', 'mean'] + ['p%d' % p for p in PERCENTILES] + ['mean_size', 'max_size']
+    writer = csv.DictWriter(f, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
@@ -6,6 +6,8 @@ MASTER NODE FILE
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal
+from scipy.interpolate import CubicSpline
+from math import factorial
 import sys
 
 # EXCURSION INPUT NODE BEGINS
@@ -23,21 +25,7 @@ def excursion(data):
     times = data[:,0]
     mags = data[:,1]
 
-    mag_min = min(mags)
-    mag_max = max(mags)
-    normalised_mags = (mags - mag_min) / (mag_max - mag_min)
-    normalised_mean = np.mean(normalised_mags)
-    above = []
-    below = []
-    for mag in normalised_mags:
-        if mag >= normalised_mean:
-            above.append(mag)
-        else:
-            below.append(mag)
-
-    percentile = 99
-    above_range = np.percentile(above, percentile) - np.percentile(above, 100 - percentile)
-    below_range = np.percentile(below, percentile) - np.percentile(below, 100 - percentile)
+    diff, above_range, below_range = excursion_batch(mags[np.newaxis])
 
 #        """Uncomment to test"""
 #        if above_range > below_range:
@@ -47,22 +35,190 @@ def excursion(data):
 #        print("Above: %s" % above_range)
 #        print("Below: %s" % below_range)
 
+    return diff[0], above_range[0], below_range[0]
+
+def excursion_batch(mags, mask=None, percentile=99):
+    """Excursion of each row of ``mags``, ignoring samples where ``mask`` is False.
+
+    Returns the arrays (diff, above, below) of the percentile ranges of the
+    normalised magnitudes above and below their mean. Sorting each row once puts
+    the samples below the mean in front of those above it, so both ranges are
+    read from the sorted rows with np.percentile's linear interpolation. A side
+    without samples gives NaN.
+    """
+    mags = np.asarray(mags, dtype=float)
+    if mask is None:
+        mask = np.ones(mags.shape, dtype=bool)
+    count = mask.sum(axis=1)
+
+    mag_min = np.where(mask, mags, np.inf).min(axis=1, keepdims=True)
+    mag_max = np.where(mask, mags, -np.inf).max(axis=1, keepdims=True)
+    normalised_mags = (mags - mag_min) / (mag_max - mag_min)
+    normalised_mean = np.where(mask, normalised_mags, 0).sum(axis=1, keepdims=True) / count[:, np.newaxis]
+
+    num_below = (mask & (normalised_mags < normalised_mean)).sum(axis=1)
+    ordered = np.sort(np.where(mask, normalised_mags, np.inf), axis=1)
+
+    def percentile_range(start, length):
+        high = _sorted_percentile(ordered, start, length, percentile / 100)
+        low = _sorted_percentile(ordered, start, length, (100 - percentile) / 100)
+        return np.where(length > 0, high - low, np.nan)
+
+    above_range = percentile_range(num_below, count - num_below)
+    below_range = percentile_range(np.zeros_like(num_below), num_below)
+
     return above_range - below_range, above_range, below_range
+
+def _sorted_percentile(ordered, start, length, q):
+    """np.percentile (linear method) of ordered[i, start:start+length] per row."""
+    virtual = np.maximum(length - 1, 0) * q
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = previous.astype(int)
+    following = np.minimum(previous + 1, np.maximum(length - 1, 0))
+
+    last = ordered.shape[1] - 1
+    a = np.take_along_axis(ordered, np.minimum(start + previous, last)[:, np.newaxis], axis=1)[:, 0]
+    b = np.take_along_axis(ordered, np.minimum(start + following, last)[:, np.newaxis], axis=1)[:, 0]
+    with np.errstate(invalid='ignore'):
+        diff_b_a = b - a
+        return np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma)
 # EXCURSION INPUT NODE ENDS
 
+# AUTOCORRELATION NODE BEGINS
+def lag_correlations(data, n=None):
+    """Forward and reversed correlations at non-negative lags from one shared FFT.
+
+    For zero-mean rows of length n this gives forward[k] = sum_j y[j+k] y[j] and
+    reverse[k] = sum_j y[j+k] y[n-1-j], i.e. the second halves of
+    np.correlate(y, y, 'same') and np.correlate(y, y[::-1], 'same'). Rows of a 2-D
+    batch may be zero padded beyond their own length ``n``.
+    """
+    data = np.asarray(data)
+    size = data.shape[-1]
+    if n is None:
+        n = np.full(data.shape[:-1], size)
+    n = np.asarray(n)[..., np.newaxis]
+
+    nfft = 1 << int(2 * size - 1).bit_length()
+    spectrum = np.fft.rfft(data, nfft, axis=-1)
+    forward = np.fft.irfft(spectrum * np.conj(spectrum), nfft, axis=-1)[..., :size]
+    conv = np.fft.irfft(spectrum * spectrum, nfft, axis=-1)
+    index = np.minimum(n - 1 + np.arange(size), nfft - 1)
+    reverse = np.take_along_axis(conv, np.broadcast_to(index, forward.shape), axis=-1)
+
+    return forward, reverse
+# AUTOCORRELATION NODE ENDS
+
 # POWER SPECTRUM NODE BEGINS
-def pspec(data):
+PSPEC_PERIODS = np.linspace(0.1, 5, 500)
+
+def pspec(data, mode='exact', periods=None, samples_per_peak=5, oversampling=5, order=6):
+    """Peak power and angular frequency of the normalised Lomb-Scargle periodogram
+    over ``periods`` (default PSPEC_PERIODS).
+
+    ``mode='exact'`` evaluates scipy.signal.lombscargle at every period, which costs
+    O(N*F). ``mode='fast'`` uses fast_lombscargle, whose cost does not grow with the
+    number of periods; its accuracy is set by ``samples_per_peak``, ``oversampling``
+    and ``order``.
+    """
     times = data[:,0]
     data = data[:,1]
 
-    rate = 5
-    num_out = 1000
-    periods = np.linspace(0.1, 5, 500)
+    if periods is None:
+        periods = PSPEC_PERIODS
     ang_freqs = 2 * np.pi / periods
     data_shift = data - np.mean(data)
-    ps = signal.lombscargle(times, data_shift, ang_freqs, normalize=True)
+    if mode == 'exact':
+        ps = signal.lombscargle(times, data_shift, ang_freqs, normalize=True)
+    elif mode == 'fast':
+        ps = fast_lombscargle(times, data_shift, ang_freqs, samples_per_peak, oversampling, order)
+    else:
+        raise ValueError("Unknown periodogram mode '%s'" % mode)
 
     return np.max(ps), np.average(ang_freqs[np.argmax(ps)])
+
+def fast_lombscargle(times, data, ang_freqs, samples_per_peak=5, oversampling=5, order=6):
+    """Normalised Lomb-Scargle power of zero-mean ``data`` at ``ang_freqs`` using the
+    Press & Rybicki (1989) method.
+
+    The trigonometric sums are computed on a regular frequency grid spanning
+    ``ang_freqs`` with ``samples_per_peak`` points per peak width 1/T, from FFTs of
+    the data extirpolated onto ``oversampling`` times as many points with Lagrange
+    polynomials of ``order`` points. They are then spline interpolated onto
+    ``ang_freqs``, where the power is evaluated.
+    """
+    freqs = np.asarray(ang_freqs) / (2 * np.pi)
+    f0 = freqs.min()
+    df = 1 / (samples_per_peak * (times.max() - times.min()))
+    num_freqs = int(np.ceil((freqs.max() - f0) / df)) + 2
+
+    grid = f0 + df * np.arange(num_freqs)
+    t_mid = 0.5 * (times.min() + times.max())
+
+    def at_freqs(S, C, freq_factor):
+        # Taking out the phase of the mid time leaves sums that vary slowly with f
+        shift = 2j * np.pi * freq_factor * t_mid
+        z = CubicSpline(grid, (C + 1j * S) * np.exp(-shift * grid))(freqs) * np.exp(shift * freqs)
+        return z.imag, z.real
+
+    w = np.full(len(times), 1 / len(times))
+    Sh, Ch = at_freqs(*trig_sum(times, w * data, df, num_freqs, f0, 1, oversampling, order), 1)
+    S2, C2 = at_freqs(*trig_sum(times, w, df, num_freqs, f0, 2, oversampling, order), 2)
+
+    tan_2omega_tau = S2 / C2
+    S2w = tan_2omega_tau / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    C2w = 1 / np.sqrt(1 + tan_2omega_tau * tan_2omega_tau)
+    Cw = np.sqrt(0.5) * np.sqrt(1 + C2w)
+    Sw = np.sqrt(0.5) * np.sign(S2w) * np.sqrt(1 - C2w)
+
+    YY = np.dot(w, data * data)
+    YC = Ch * Cw + Sh * Sw
+    YS = Sh * Cw - Ch * Sw
+    CC = 0.5 * (1 + C2 * C2w + S2 * S2w)
+    SS = 0.5 * (1 - C2 * C2w - S2 * S2w)
+    return (YC * YC / CC + YS * YS / SS) / YY
+
+def trig_sum(times, h, df, num_freqs, f0=0, freq_factor=1, oversampling=5, order=4):
+    """Approximate sum(h * sin(2 pi f t)) and sum(h * cos(2 pi f t)) for the
+    frequencies f = freq_factor * (f0 + df * k), k = 0..num_freqs-1, via one FFT.
+    """
+    df *= freq_factor
+    f0 *= freq_factor
+    t0 = times.min()
+    if f0 > 0:
+        h = h * np.exp(2j * np.pi * f0 * (times - t0))
+
+    tnorm = ((times - t0) * df) % 1
+    nfft = 1 << int(num_freqs * oversampling - 1).bit_length()
+    grid = extirpolate(tnorm * nfft, h, nfft, order)
+    fftgrid = np.fft.ifft(grid)[:num_freqs]
+    if t0 != 0:
+        fftgrid *= np.exp(2j * np.pi * t0 * (f0 + df * np.arange(num_freqs)))
+
+    return nfft * fftgrid.imag, nfft * fftgrid.real
+
+def extirpolate(x, y, size, order=4):
+    """Spread the values ``y`` at non-integer positions ``x`` onto a regular grid of
+    ``size`` points so that sums of any smooth function over the grid approximate
+    sums over the original points (Press & Rybicki 1989).
+    """
+    result = np.zeros(size, dtype=np.result_type(y, float))
+
+    integers = (x % 1 == 0)
+    np.add.at(result, x[integers].astype(int), y[integers])
+    x, y = x[~integers], y[~integers]
+
+    ilo = np.clip((x - order // 2).astype(int), 0, size - order)
+    numerator = y * np.prod(x - ilo - np.arange(order)[:, np.newaxis], 0)
+    denominator = factorial(order - 1)
+    for j in range(order):
+        if j > 0:
+            denominator *= j / (j - order)
+        index = ilo + (order - 1 - j)
+        np.add.at(result, index, numerator / (denominator * (x - index)))
+
+    return result
 # POWER SPECTRUM NODE ENDS
 
 if __name__ == "__main__":
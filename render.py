@@ -0,0 +1,215 @@
+"""
+Renders the pictures of a training run, nn.png and accuracy.png, from the
+checkpoints train.py writes. It runs in a process of its own so that training
+never waits for matplotlib: a picture is redrawn only when the checkpoint is newer
+than it, and both figures are built once and then updated in place. Pictures of a
+checkpoint that was replaced while they were drawn are never published, and a
+failed render is reported and retried at the next check.
+
+Usage: python render.py [DIRECTORY] [--interval SECONDS] [--once]
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.patheffects as PathEffects
+import os
+import time
+import argparse
+import traceback
+import datetime
+import numpy as np
+from checkpoint import read_state, STATE_FILE
+from network import load
+from lightcurve import MicroLensing, NonEvent, Periodic
+
+NETWORK_IMAGE = 'nn.png'
+ACCURACY_IMAGE = 'accuracy.png'
+
+# Seconds between checks for a new checkpoint
+POLL_INTERVAL = 5
+
+# Lightcurves between the rolling training accuracies of old checkpoints
+ROLLING_INTERVAL = 30000
+
+TYPES = [MicroLensing, NonEvent, Periodic]
+INPUT_LABELS = ['AC_std', 'AC_max', 'SYM_std', 'SYM_max', 'excursion_diff', 'excursion_above', 'excursion_below', 'noise', 'slope', 'power_peak', 'power_mean']
+
+GREEN = "#55BB55FF"
+RED = "#BB5555FF"
+
+def human_format(num):
+  num = float('{:.3g}'.format(num))
+  magnitude = 0
+  while abs(num) >= 1000:
+    magnitude += 1
+    num /= 1000.0
+  return '{}{}'.format('{:f}'.format(num).rstrip('0').rstrip('.'), ['', 'K', 'M', 'B', 'T'][magnitude])
+
+class NetworkFigure:
+
+  def __init__(self, layer_sizes, layer_text, left=.05, right=.95, bottom=.08, top=.98):
+    """ Draws the cartoon of a network with ``layer_sizes``: a circle per node,
+    annotated with ``layer_text`` in top-down left-right order, and a line per
+    weight. Only the lines and the status texts change afterwards. """
+    self.layer_sizes = layer_sizes
+    self.fig = plt.figure(figsize=(7, 7))
+    ax = self.fig.gca()
+    ax.axis('off')
+
+    text = layer_text[:]
+    v_spacing = (top - bottom)/float(max(layer_sizes))
+    h_spacing = (right - left)/float(len(layer_sizes) - 1)
+    layer_tops = [v_spacing*(layer_size - 1)/2. + (top + bottom)/2. for layer_size in layer_sizes]
+
+    # Nodes
+    for n, layer_size in enumerate(layer_sizes):
+      for m in range(layer_size):
+        x = n*h_spacing + left
+        y = layer_tops[n] - m*v_spacing
+        ax.add_artist(plt.Circle((x, y), v_spacing/4., color="#FFFFFFFF", ec='k', zorder=0))
+
+        # Node annotations
+        if text:
+          txt = ax.text(x, y, text.pop(0), ha='center', va='center')
+          txt.set_path_effects([PathEffects.withStroke(linewidth=5, foreground='w')])
+
+    # Edges, in the order of the weights of each layer transposed
+    self.lines = []
+    for n, (layer_size_a, layer_size_b) in enumerate(zip(layer_sizes[:-1], layer_sizes[1:])):
+      for m in range(layer_size_a):
+        for o in range(layer_size_b):
+          line = plt.Line2D([n*h_spacing + left, (n + 1)*h_spacing + left], [layer_tops[n] - m*v_spacing, layer_tops[n + 1] - o*v_spacing], zorder=-1)
+          ax.add_artist(line)
+          self.lines.append(line)
+
+    self.status = [ax.text(0.5, y, "", color=color, ha='center', va='center')
+                   for y, color in [(0.06, "#000000FF"), (0.03, "#000000FF"), (0, "#666666FF")]]
+
+  def update(self, weights, accuracy, total_gen, timestamp):
+    values = np.concatenate([np.asarray(w).transpose().ravel() for w in weights])
+    for line, weight in zip(self.lines, values):
+      line.set_color(GREEN if weight > 0 else RED)
+      line.set_linewidth(min(abs(weight), 5))
+
+    current = str(round(100*accuracy, 2))+"%" if accuracy is not None else "pending"
+    self.status[0].set_text("Current accuracy: "+current)
+    self.status[1].set_text("Total lightcurves generated: "+human_format(total_gen))
+    self.status[2].set_text(timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+
+class AccuracyFigure:
+
+  def __init__(self, types):
+    """ Held-out accuracy against lightcurves processed, overall and per type. """
+    self.fig = plt.figure(figsize=(7, 7))
+    self.ax = self.fig.gca()
+    self.lines = {'accuracy': self.ax.plot([], [], color=(0,0,1,1), label='All')[0]}
+    for ev, alpha in zip(types, [0.5, 0.35, 0.2]):
+      self.lines['accuracy_'+ev.__name__] = self.ax.plot([], [], color=(0,0,1,alpha), label=ev.__name__)[0]
+    self.rolling = None
+    self.ax.set_xlabel("Lightcurves Processed")
+    self.ax.set_ylabel("Held-out Accuracy (%)")
+    self.ax.set_title("Network Accuracy")
+
+  def update(self, evaluations, rolling_accuracies=None):
+    """ ``rolling_accuracies``, the training accuracy windows saved by runs from
+    before held-out evaluation, adds the last 150K window of that history. """
+    accuracy_x = [result['total_gen'] for result in evaluations]
+    for key, line in self.lines.items():
+      line.set_data(accuracy_x, [100*result.get(key, np.nan) for result in evaluations])
+    if rolling_accuracies and rolling_accuracies[1]:
+      if self.rolling is None:
+        self.rolling = self.ax.plot([], [], color=(0,0,0,0.4), linestyle='--', label='Training (last 150K)')[0]
+      rolling_x = np.linspace(0, len(rolling_accuracies[1]) * ROLLING_INTERVAL, len(rolling_accuracies[1]))
+      self.rolling.set_data(rolling_x, rolling_accuracies[1])
+    self.ax.legend()
+    self.ax.relim()
+    self.ax.autoscale_view()
+
+class Renderer:
+
+  def __init__(self, directory='.', types=TYPES):
+    self.directory = directory
+    self.types = types
+    self.network_figure = None
+    self.accuracy_figure = None
+
+  def stale(self):
+    """ Whether the checkpoint is newer than either picture. """
+    state_path = os.path.join(self.directory, STATE_FILE)
+    if not os.path.exists(state_path):
+      return False
+    state_time = os.path.getmtime(state_path)
+    for image in [NETWORK_IMAGE, ACCURACY_IMAGE]:
+      path = os.path.join(self.directory, image)
+      if not os.path.exists(path) or os.path.getmtime(path) < state_time:
+        return True
+    return False
+
+  def render(self):
+    """ Redraws both pictures from the current checkpoint. Returns False, leaving
+    the pictures as they were, if the checkpoint was replaced while they were
+    drawn. """
+    state_path = os.path.join(self.directory, STATE_FILE)
+    state_time = os.path.getmtime(state_path)
+    timestamp = datetime.datetime.fromtimestamp(state_time)
+    state = read_state(self.directory)
+    try:
+      nn = load(os.path.join(self.directory, state['network']))
+    except FileNotFoundError:
+      return False
+
+    if self.network_figure is None or self.network_figure.layer_sizes != nn.sizes:
+      labels = INPUT_LABELS + ["" for _ in range(sum(nn.sizes[1:-1]))] + [ev.__name__ for ev in self.types]
+      if self.network_figure is not None:
+        plt.close(self.network_figure.fig)
+      self.network_figure = NetworkFigure(nn.sizes, labels)
+    if self.accuracy_figure is None:
+      self.accuracy_figure = AccuracyFigure(self.types)
+
+    evaluations = state.get('evaluations', [])
+    accuracy = evaluations[-1]['accuracy'] if evaluations else None
+    self.network_figure.update(nn.weights, accuracy, state['total_gen'], timestamp)
+    self.accuracy_figure.update(evaluations, state.get('rolling_accuracies'))
+
+    pictures = [(self.accuracy_figure.fig, ACCURACY_IMAGE), (self.network_figure.fig, NETWORK_IMAGE)]
+    tmp_paths = [self.save(fig, image) for fig, image in pictures]
+    if os.path.getmtime(state_path) != state_time:
+      # The newer checkpoint keeps the pictures stale, so the next check draws it
+      for tmp_path in tmp_paths:
+        os.remove(tmp_path)
+      return False
+    for (_, image), tmp_path in zip(pictures, tmp_paths):
+      os.replace(tmp_path, os.path.join(self.directory, image))
+    return True
+
+  def save(self, fig, image):
+    """ Saves ``fig`` under a temporary name next to ``image`` and returns that
+    name, so that readers of the picture never see a partial file. """
+    root, ext = os.path.splitext(os.path.join(self.directory, image))
+    tmp_path = root + '.tmp' + ext
+    fig.savefig(tmp_path)
+    return tmp_path
+
+def watch(directory='.', interval=POLL_INTERVAL, once=False):
+  """ Renders whenever the checkpoint in ``directory`` is newer than the pictures.
+  Errors are printed and the pictures tried again at the next check. """
+  renderer = Renderer(directory)
+  while True:
+    try:
+      if renderer.stale():
+        renderer.render()
+    except Exception:
+      print("Failed to render the pictures of " + os.path.abspath(directory) + ":")
+      traceback.print_exc()
+    if once:
+      return
+    time.sleep(interval)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Render the pictures of a training run from its checkpoints.")
+  parser.add_argument('directory', nargs='?', default='.')
+  parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between checks for a new checkpoint")
+  parser.add_argument('--once', action='store_true', help="render once if needed and exit")
+  args = parser.parse_args()
+  watch(args.directory, args.interval, args.once)
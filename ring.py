@@ -0,0 +1,110 @@
+"""
+Shared-memory transport of training samples from the generation workers to the
+trainer. Samples live in one preallocated ring of fixed-layout input and output
+rows, split into blocks of ``block_rows``; a worker fills a whole block at a time
+and the trainer takes runs of consecutive blocks as zero-copy views, so nothing
+is pickled or sent through a pipe.
+
+Writers wait on a semaphore counting free blocks, number the blocks they claim
+under a lock and mark them ready under a condition that the reader waits on.
+Blocks are read in claim order, so a batch of ``k`` blocks is always complete
+and, as the ring holds a multiple of ``k`` blocks, contiguous.
+"""
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+class Ring:
+
+  def __init__(self, input_size, output_size, block_rows, blocks, dtype=np.float64):
+    """ Allocates a ring of ``blocks`` blocks of ``block_rows`` samples, each an
+    ``input_size`` input row and an ``output_size`` output row. """
+    self.input_size = input_size
+    self.output_size = output_size
+    self.block_rows = block_rows
+    self.blocks = blocks
+    self.dtype = np.dtype(dtype)
+    rows = block_rows * blocks
+    size = rows * (input_size + output_size) * self.dtype.itemsize + blocks + 8
+    self.shm = shared_memory.SharedMemory(create=True, size=size)
+    self.owner = True
+    self.attach()
+    self.ready[:] = 0
+    self.claimed[:] = 0
+
+    self.free = mp.Semaphore(blocks)
+    self.claim_lock = mp.Lock()
+    self.condition = mp.Condition()
+    self.read = 0
+
+  def attach(self):
+    """ Lays out the arrays over the shared memory: inputs, outputs, a ready flag
+    per block and the count of claimed blocks. """
+    rows = self.block_rows * self.blocks
+    offset = 0
+    self.claimed = np.ndarray((1,), np.int64, self.shm.buf, offset)
+    offset += 8
+    self.x = np.ndarray((rows, self.input_size), self.dtype, self.shm.buf, offset)
+    offset += self.x.nbytes
+    self.y = np.ndarray((rows, self.output_size), self.dtype, self.shm.buf, offset)
+    offset += self.y.nbytes
+    self.ready = np.ndarray((self.blocks,), np.int8, self.shm.buf, offset)
+
+  def __getstate__(self):
+    state = dict(self.__dict__, shm=self.shm.name, owner=False)
+    for name in ['claimed', 'x', 'y', 'ready']:
+      del state[name]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.shm = shared_memory.SharedMemory(name=state['shm'])
+    self.attach()
+
+  def put(self, x, y):
+    """ Writes one block of ``block_rows`` inputs and outputs, waiting while the
+    ring is full. """
+    self.free.acquire()
+    with self.claim_lock:
+      block = int(self.claimed[0] % self.blocks)
+      self.claimed[0] += 1
+
+    rows = slice(block * self.block_rows, (block + 1) * self.block_rows)
+    self.x[rows] = x
+    self.y[rows] = y
+    with self.condition:
+      self.ready[block] = 1
+      self.condition.notify_all()
+
+  def get(self, blocks):
+    """ Waits for the next ``blocks`` blocks and returns views of their inputs and
+    outputs. ``blocks`` must divide the ring size. The views stay valid until
+    the blocks are handed back with ``release``. """
+    if self.blocks % blocks:
+      raise ValueError("Batches of {} blocks do not tile a ring of {}".format(blocks, self.blocks))
+    first = self.read % self.blocks
+    with self.condition:
+      self.condition.wait_for(lambda: self.ready[first:first + blocks].all())
+
+    rows = slice(first * self.block_rows, (first + blocks) * self.block_rows)
+    return self.x[rows], self.y[rows]
+
+  def release(self, blocks):
+    """ Hands the ``blocks`` blocks returned by the last ``get`` back to the writers. """
+    first = self.read % self.blocks
+    with self.condition:
+      self.ready[first:first + blocks] = 0
+    self.read += blocks
+    for _ in range(blocks):
+      self.free.release()
+
+  def occupancy(self):
+    """ Fraction of the blocks that are written and waiting to be read. """
+    return float(np.mean(self.ready))
+
+  def close(self):
+    del self.claimed, self.x, self.y, self.ready
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
@@ -0,0 +1,203 @@
+"""
+Status server of a training run, standard library only. It reads the files
+train.py and render.py leave in the run directory and serves:
+
+  /                   www/index.html, a page polling the endpoints below
+  /metrics            the current metrics as JSON, with a version of each picture
+  /accuracy?since=N   the held-out evaluations from the N'th on, and the N to ask
+                      for next time
+  /nn.png, /accuracy.png
+                      the latest rendered pictures
+
+Files are parsed only when they change, and every response carries an ETag, so a
+poll that finds nothing new costs a few stat calls and a 304.
+
+Usage: python status.py [DIRECTORY] [--host HOST] [--port PORT]
+"""
+
+import os
+import json
+import argparse
+import threading
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+STATE_FILE = 'checkpoint.json'
+METRICS_FILE = 'metrics.jsonl'
+IMAGES = ['nn.png', 'accuracy.png']
+INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'www', 'index.html')
+
+# Evaluations averaged for each accuracy window
+ACCURACY_WINDOWS = [1, 5, 20]
+
+class RunFiles:
+  """ The parsed contents of the files of a run directory, reloaded when their
+  modification time or size changes. """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.cache = {}
+    self.lock = threading.Lock()
+
+  def version(self, name):
+    """ Modification time and size of ``name``, or None if it does not exist. """
+    try:
+      stat = os.stat(os.path.join(self.directory, name))
+    except FileNotFoundError:
+      return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+  def get(self, name, parse):
+    version = self.version(name)
+    with self.lock:
+      cached = self.cache.get(name)
+      if cached is not None and cached[0] == version:
+        return cached[1]
+    value = parse(os.path.join(self.directory, name)) if version is not None else None
+    with self.lock:
+      self.cache[name] = (version, value)
+    return value
+
+  def state(self):
+    return self.get(STATE_FILE, read_json)
+
+  def last_metrics(self):
+    return self.get(METRICS_FILE, read_last_line)
+
+  def etag(self, *names):
+    return '"' + '-'.join('%x.%x' % version if version else '0' for version in map(self.version, names)) + '"'
+
+def read_json(path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except ValueError:
+    return None
+
+def read_last_line(path):
+  """ The last complete JSON line of ``path``, reading only the end of the file. """
+  with open(path, 'rb') as f:
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(size - 65536, 0))
+    lines = f.read().splitlines()
+  for line in reversed(lines):
+    try:
+      return json.loads(line)
+    except ValueError:
+      continue
+  return None
+
+def metrics(files):
+  """ The current metrics of the run: progress, accuracy windows over the latest
+  evaluations and the throughput of the last telemetry record. """
+  state = files.state() or {}
+  evaluations = state.get('evaluations', [])
+  accuracy = [result['accuracy'] for result in evaluations]
+  result = {'iterations': state.get('iterations'),
+            'total_gen': state.get('total_gen'),
+            'evaluations': len(evaluations),
+            'accuracy': {'last_%d' % n: sum(accuracy[-n:]) / len(accuracy[-n:]) if accuracy else None for n in ACCURACY_WINDOWS},
+            'best_accuracy': max(accuracy) if accuracy else None,
+            'training': state.get('training')}
+  for name in ['accuracy_' + key for key in ['MicroLensing', 'NonEvent', 'Periodic']]:
+    if evaluations and name in evaluations[-1]:
+      result['accuracy'][name] = evaluations[-1][name]
+
+  telemetry = files.last_metrics()
+  if telemetry is not None:
+    result['throughput'] = {key: telemetry.get(key) for key in ['time', 'trained_per_second', 'generated_per_second', 'ring_occupancy']}
+    result['trainer'] = telemetry.get('trainer')
+
+  # render.py replaces the pictures some time after each checkpoint, so clients
+  # reload them when these change
+  result['images'] = {image: files.etag(image).strip('"') for image in IMAGES}
+  return result
+
+class StatusHandler(BaseHTTPRequestHandler):
+
+  files = None
+
+  def do_GET(self):
+    url = urlsplit(self.path)
+    if url.path in ('/', '/index.html'):
+      self.send_file(INDEX, 'text/html; charset=utf-8')
+    elif url.path == '/metrics':
+      etag = self.files.etag(STATE_FILE, METRICS_FILE, *IMAGES)
+      self.send_json(lambda: metrics(self.files), etag)
+    elif url.path == '/accuracy':
+      try:
+        since = max(int(parse_qs(url.query).get('since', ['0'])[0]), 0)
+      except ValueError:
+        return self.send_error(HTTPStatus.BAD_REQUEST, "since must be an integer")
+      etag = self.files.etag(STATE_FILE)[:-1] + '-%d"' % since
+
+      def series():
+        evaluations = (self.files.state() or {}).get('evaluations', [])
+        return {'since': since, 'next': len(evaluations), 'points': evaluations[since:]}
+      self.send_json(series, etag)
+    elif url.path.lstrip('/') in IMAGES:
+      self.send_file(os.path.join(self.files.directory, url.path.lstrip('/')), 'image/png')
+    else:
+      self.send_error(HTTPStatus.NOT_FOUND)
+
+  def not_modified(self, etag):
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(HTTPStatus.NOT_MODIFIED)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return True
+    return False
+
+  def send_json(self, build, etag):
+    """ Sends the JSON of ``build()``, or 304 if the client holds ``etag``. """
+    if self.not_modified(etag):
+      return
+    body = json.dumps(build()).encode()
+    self.send_body(body, 'application/json', etag)
+
+  def send_file(self, path, content_type):
+    try:
+      stat = os.stat(path)
+    except FileNotFoundError:
+      return self.send_error(HTTPStatus.NOT_FOUND)
+    etag = '"%x.%x"' % (stat.st_mtime_ns, stat.st_size)
+    if self.not_modified(etag):
+      return
+    with open(path, 'rb') as f:
+      body = f.read()
+    self.send_body(body, content_type, etag)
+
+  def send_body(self, body, content_type, etag):
+    self.send_response(HTTPStatus.OK)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', etag)
+    self.send_header('Cache-Control', 'no-cache')
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    # Polled every few seconds, so only errors are logged
+    pass
+
+  def log_error(self, format, *args):
+    BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def serve(directory='.', host='127.0.0.1', port=8000):
+  handler = type('Handler', (StatusHandler,), {'files': RunFiles(directory)})
+  server = ThreadingHTTPServer((host, port), handler)
+  print("Serving the status of " + os.path.abspath(directory) + " on http://" + host + ":" + str(port) + "/")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Serve the status of a training run.")
+  parser.add_argument('directory', nargs='?', default='.')
+  parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: %(default)s)")
+  parser.add_argument('--port', type=int, default=8000)
+  args = parser.parse_args()
+  serve(args.directory, args.host, args.port)
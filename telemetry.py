@@ -0,0 +1,172 @@
+"""
+Always-on pipeline telemetry for train.py: how fast each generation worker
+produces curves and how long it waits for room in the ring, how full the ring is
+and where the trainer's time goes. Every METRICS_INTERVAL seconds a record is
+appended to a JSON lines file, rotated once it grows past METRICS_MAX_BYTES, and
+``summary`` describes the period since its last call.
+"""
+
+import os
+import json
+import time
+import datetime
+import contextlib
+import numpy as np
+import multiprocessing as mp
+
+METRICS_FILE = 'metrics.jsonl'
+METRICS_INTERVAL = 10
+METRICS_MAX_BYTES = 10 * 1024 * 1024
+
+# Per-worker counters: curves produced, seconds generating them, seconds blocked
+# handing them over, and the state the worker is in (BUSY, BLOCKED or 0 before it
+# starts) with the time it entered it
+CURVES, BUSY, BLOCKED, STATE, SINCE = range(5)
+
+PHASES = ['wait', 'train', 'evaluate', 'save']
+
+class Telemetry:
+
+  def __init__(self, workers, path=METRICS_FILE, interval=METRICS_INTERVAL):
+    self.workers = workers
+    self.path = path
+    self.interval = interval
+    self.raw = mp.RawArray('d', max(workers, 1) * 5)
+    self.lock = mp.Lock()
+    # Process holding each slot, and how many processes have held it
+    self.pids = mp.RawArray('l', max(workers, 1))
+    self.claims = mp.RawArray('i', max(workers, 1))
+
+    self.phases = dict.fromkeys(PHASES, 0.0)
+    self.trained = 0
+    self.occupancy = [0.0, 0]
+    self.occupancy_min = {}
+    self.marks = {}
+    self.mark('file')
+    self.mark('summary')
+
+  def counters(self):
+    return np.frombuffer(self.raw, dtype=np.float64).reshape(-1, 5)
+
+  def worker_totals(self, now):
+    """ Curves, busy and blocked seconds of every worker up to ``now``, counting
+    the part of the interval each worker is in that has passed, so that time is
+    split exactly between the periods of ``since``. """
+    with self.lock:
+      counters = self.counters().copy()
+    totals = counters[:, :STATE]
+    for i, row in enumerate(counters):
+      if row[STATE]:
+        totals[i, int(row[STATE])] += max(now - row[SINCE], 0.0)
+    return totals
+
+  #### Generation workers
+
+  def register(self):
+    """ Claims the counters of the calling worker process: the first slot never
+    held, or else one whose process has exited, as when a pool replaces a worker.
+    Sets ``slot`` and ``restarts``, the number of processes that held it before. """
+    with self.lock:
+      for slot, pid in enumerate(self.pids):
+        if pid == 0 or not process_alive(pid):
+          break
+      else:
+        raise RuntimeError("All " + str(len(self.pids)) + " telemetry slots are held by live workers")
+      self.slot, self.restarts = slot, self.claims[slot]
+      self.pids[slot] = os.getpid()
+      self.claims[slot] += 1
+      self.counters()[slot, STATE] = 0
+
+  def enter(self, state, curves=0):
+    """ Moves the calling worker into ``state``, BUSY or BLOCKED, closing the
+    interval of the state it was in, and counts ``curves`` it has produced. """
+    now = time.time()
+    with self.lock:
+      counters = self.counters()[self.slot]
+      if counters[STATE]:
+        counters[int(counters[STATE])] += now - counters[SINCE]
+      counters[CURVES] += curves
+      counters[STATE] = state
+      counters[SINCE] = now
+
+  #### Trainer
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """ Adds the time spent in the body to the trainer phase ``name``. """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases[name] += time.perf_counter() - start
+
+  def record_trained(self, curves):
+    """ Counts curves the trainer has trained on. """
+    self.trained += curves
+
+  def sample_occupancy(self, fraction):
+    """ Records how full the ring is, as a fraction of its blocks. """
+    self.occupancy[0] += fraction
+    self.occupancy[1] += 1
+    for name in self.occupancy_min:
+      self.occupancy_min[name] = min(self.occupancy_min[name], fraction)
+
+  def mark(self, name, now=None):
+    now = now or time.time()
+    self.marks[name] = (now, self.worker_totals(now), dict(self.phases), self.trained, list(self.occupancy))
+    self.occupancy_min[name] = 1.0
+
+  def since(self, name):
+    """ Metrics of the period since the mark ``name``, which is then reset. """
+    start, counters, phases, trained, occupancy = self.marks[name]
+    now = time.time()
+    seconds = max(now - start, 1e-9)
+    totals = self.worker_totals(now)
+    delta = totals - counters
+    samples = self.occupancy[1] - occupancy[1]
+    occupancy_min = self.occupancy_min[name]
+    self.mark(name, now)
+
+    return {'time': datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'seconds': round(seconds, 3),
+            'trained_per_second': round((self.trained - trained) / seconds, 2),
+            'generated_per_second': round(delta[:self.workers, CURVES].sum() / seconds, 2),
+            'workers': [{'curves_per_second': round(d[CURVES] / seconds, 2),
+                         'busy': round(d[BUSY] / seconds, 4),
+                         'blocked': round(d[BLOCKED] / seconds, 4)} for d in delta[:self.workers]],
+            'ring_occupancy': round((self.occupancy[0] - occupancy[0]) / samples, 4) if samples else None,
+            'ring_occupancy_min': round(occupancy_min, 4) if samples else None,
+            'trainer': {phase: round((self.phases[phase] - phases[phase]) / seconds, 4) for phase in PHASES}}
+
+  def tick(self, **info):
+    """ Appends a record with ``info`` to the metrics file if the interval has
+    passed. """
+    if time.time() - self.marks['file'][0] < self.interval:
+      return
+    record = dict(self.since('file'), **info)
+    if os.path.exists(self.path) and os.path.getsize(self.path) > METRICS_MAX_BYTES:
+      os.replace(self.path, self.path + '.1')
+    with open(self.path, 'a') as f:
+      f.write(json.dumps(record) + '\n')
+
+  def summary(self):
+    """ One line describing the pipeline since the last summary. """
+    metrics = self.since('summary')
+    trainer = ", ".join("{} {:.0f}%".format(phase, 100 * share) for phase, share in metrics['trainer'].items())
+    line = "Pipeline: trained " + str(metrics['trained_per_second']) + " curves/s; trainer " + trainer
+    if metrics['ring_occupancy'] is not None:
+      line += "; ring {:.0f}% full (min {:.0f}%)".format(100 * metrics['ring_occupancy'], 100 * metrics['ring_occupancy_min'])
+    if metrics['workers'] and metrics['generated_per_second']:
+      rates = [worker['curves_per_second'] for worker in metrics['workers']]
+      blocked = np.mean([worker['blocked'] for worker in metrics['workers']])
+      line += "; workers {:.1f}-{:.1f} curves/s, {:.0f}% blocked".format(min(rates), max(rates), 100 * blocked)
+    return line
+
+def process_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
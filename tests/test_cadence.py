@@ -0,0 +1,40 @@
+"""
+Inputs over a shared cadence against LightCurve.load_curve and calculate_inputs,
+curve by curve, on the unsorted dates of validation/1.
+"""
+
+import os
+import numpy as np
+import pytest
+from lightcurve import LightCurve
+from cadence import CadencePlan
+
+DATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'validation', '1', 'dates')
+
+@pytest.fixture(scope='module')
+def field():
+  dates = np.loadtxt(DATES)
+  assert (np.diff(dates) < 0).any()
+  rng = np.random.default_rng(6)
+  t = (dates - dates[0])[None, :]
+  periods = rng.uniform(3, 40, (8, 1))
+  flux = 10 + rng.normal(0, 0.3, (8, len(dates))) + rng.uniform(0, 2, (8, 1)) * np.sin(2 * np.pi * t / periods)
+  flux[2] += 5 / (1 + ((t[0] - 150) / 10)**2)
+  flux[3, 17] = np.nan
+  flux_err = rng.uniform(0.1, 0.5, flux.shape)
+  return dates, flux, flux_err
+
+def object_inputs(dates, flux, flux_err, names=None):
+  lightcurve = LightCurve()
+  lightcurve.load_curve(dates, flux, flux_err)
+  return lightcurve.calculate_inputs(names).ravel()
+
+@pytest.mark.parametrize('mode', ['exact', 'fast'])
+@pytest.mark.parametrize('names', [None, ['power_peak', 'fitted_slope', 'ac_symm_max', 'excursion_below']])
+def test_plan_inputs_match_calculate_inputs(field, monkeypatch, mode, names):
+  monkeypatch.setattr(LightCurve, 'PSPEC_MODE', mode)
+  dates, flux, flux_err = field
+  inputs = CadencePlan(dates).inputs(flux, flux_err, names, chunk_size=3)
+  assert inputs.shape == (len(flux), len(names or LightCurve.INPUT_NAMES))
+  for row, curve, error in zip(inputs, flux, flux_err):
+    np.testing.assert_allclose(row, object_inputs(dates, curve, error, names), rtol=1e-7, atol=1e-9)
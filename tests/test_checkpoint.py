@@ -0,0 +1,67 @@
+"""
+Background checkpoints: resuming restores the network, its optimizer and the
+random generators, and a failed write is raised in the training loop.
+"""
+
+import os
+import random
+import numpy as np
+import pytest
+from network import Network, Adam
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, restore_rng
+
+def train(nn, seed):
+  rng = np.random.default_rng(seed)
+  x = rng.normal(size=(20, 4))
+  y = np.eye(3)[rng.integers(0, 3, 20)]
+  nn.train_rows(x, y, 1, 5, 0.1)
+
+def test_checkpoint_resumes_network_optimizer_and_rng(tmp_path):
+  np.random.seed(0)
+  nn = Network([4, 5, 3], optimizer=Adam())
+  writer = CheckpointWriter(str(tmp_path))
+  try:
+    train(nn, 1)
+    writer.save(nn, {'iterations': 1, 'rng': rng_state()})
+    writer.flush()
+    train(nn, 2)
+    random.seed(3)
+    np.random.seed(3)
+    writer.save(nn, {'iterations': 2, 'rng': rng_state()})
+    expected = (random.random(), np.random.rand())
+    # Training goes on while the checkpoint is written
+    train(nn, 4)
+    writer.flush()
+  finally:
+    writer.close()
+
+  assert sorted(os.listdir(str(tmp_path))) == ['checkpoint-2.nnb', 'checkpoint-2.opt', 'checkpoint.json']
+  loaded, state = load_checkpoint(str(tmp_path))
+  assert state['iterations'] == 2
+
+  np.random.seed(0)
+  reference = Network([4, 5, 3], optimizer=Adam())
+  train(reference, 1)
+  train(reference, 2)
+  for ours, theirs in zip(loaded.weights + loaded.biases, reference.weights + reference.biases):
+    np.testing.assert_array_equal(ours, theirs)
+  assert type(loaded.optimizer) is Adam and loaded.optimizer.t == reference.optimizer.t
+  for ours, theirs in zip(loaded.optimizer.state, reference.optimizer.state):
+    for a, b in zip(ours, theirs):
+      np.testing.assert_array_equal(a, b)
+
+  restore_rng(state['rng'])
+  assert (random.random(), np.random.rand()) == expected
+
+def test_flush_raises_a_failed_write(tmp_path, capsys):
+  writer = CheckpointWriter(str(tmp_path))
+  def fail(nn, state, copies):
+    raise OSError("disk full")
+  writer.write = fail
+  try:
+    writer.save(Network([2, 2]), {'iterations': 1})
+    with pytest.raises(OSError, match="disk full"):
+      writer.flush()
+  finally:
+    writer.close()
+  assert "Failed to write the checkpoint of iteration 1" in capsys.readouterr().out
@@ -0,0 +1,62 @@
+"""
+Sharded corpora: resumed writes keep the shards whose settings match, and
+batches visit every row at most once per pass.
+"""
+
+import os
+import numpy as np
+import pytest
+import corpus
+from corpus import write_corpus, shard_record, Corpus
+
+def shard_times(directory, shards):
+  return [os.stat(os.path.join(directory, 'shard-%05d.json' % i)).st_mtime_ns for i in range(shards)]
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+  monkeypatch.setattr(corpus, 'CHUNK_SIZE', 4)
+
+def test_rerun_keeps_matching_shards(tmp_path, small_chunks):
+  directory = str(tmp_path)
+  write_corpus(directory, 25, shard_size=10, workers=2, seed=1)
+  assert [shard_record(directory, i)['size'] for i in range(3)] == [10, 10, 5]
+  first = Corpus(directory)
+  assert len(first) == 25
+  inputs = [np.array(first.shard(i)[0]) for i in range(3)]
+  times = shard_times(directory, 3)
+
+  # Same settings, only the last shard changes size
+  write_corpus(directory, 30, shard_size=10, workers=2, seed=1)
+  rerun = shard_times(directory, 3)
+  assert rerun[:2] == times[:2] and rerun[2] != times[2]
+  assert shard_record(directory, 2)['size'] == 10
+  second = Corpus(directory)
+  assert len(second) == 30
+  for i in range(2):
+    np.testing.assert_array_equal(second.shard(i)[0], inputs[i])
+
+  # A new seed regenerates every shard
+  write_corpus(directory, 30, shard_size=10, workers=2, seed=2)
+  assert all(ours != theirs for ours, theirs in zip(shard_times(directory, 3), rerun))
+  assert all(shard_record(directory, i)['seed'] == 2 for i in range(3))
+  assert not np.array_equal(Corpus(directory).shard(0)[0], inputs[0])
+
+def test_one_epoch_yields_each_row_at_most_once(tmp_path, small_chunks):
+  directory = str(tmp_path)
+  write_corpus(directory, 26, shard_size=6, workers=1, seed=3)
+  data = Corpus(directory)
+  rows = {}
+  for i in range(5):
+    inputs, labels, _ = data.shard(i)
+    for x, label in zip(inputs, labels):
+      rows[x.tobytes()] = label
+  assert len(rows) == 26
+
+  seen = []
+  # One shard at a time, shards of 6 rows leave 2 over for the next group
+  for x, y in data.batches(4, np.random.default_rng(0), shards_in_memory=1, epochs=1):
+    assert x.shape == (4, len(data.inputs)) and y.shape == (4, 3)
+    for row, output in zip(x, y):
+      assert np.argmax(output) == rows[row.tobytes()]
+      seen.append(row.tobytes())
+  assert len(seen) == len(set(seen)) == 24
@@ -0,0 +1,51 @@
+"""
+The feature cache: hits skip the computation, and any change to the inputs or to
+the feature settings misses.
+"""
+
+import numpy as np
+import pytest
+from lightcurve import LightCurve
+from feature_cache import cached_features
+
+def counting(values):
+  """ A compute function returning ``values`` and recording its calls. """
+  def compute():
+    compute.calls += 1
+    return values
+  compute.calls = 0
+  return compute
+
+@pytest.fixture
+def arrays():
+  rng = np.random.default_rng(5)
+  return [np.array(['ac_max', 'noise_est']), rng.normal(size=40), rng.normal(size=(6, 40))]
+
+def test_second_call_reads_the_cache(tmp_path, arrays):
+  compute = counting(np.arange(12.0).reshape(6, 2))
+  first = cached_features(str(tmp_path), arrays, compute)
+  second = cached_features(str(tmp_path), arrays, compute)
+  assert compute.calls == 1
+  assert isinstance(second, np.memmap)
+  np.testing.assert_array_equal(second, first)
+  np.testing.assert_array_equal(second, np.arange(12.0).reshape(6, 2))
+
+@pytest.mark.parametrize('setting, value', [('FEATURE_VERSION', LightCurve.FEATURE_VERSION + 1),
+                                            ('AC_BACKEND', 'direct'),
+                                            ('PSPEC_MODE', 'fast')])
+def test_changed_settings_miss(tmp_path, monkeypatch, arrays, setting, value):
+  compute = counting(np.zeros((6, 2)))
+  cached_features(str(tmp_path), arrays, compute)
+  monkeypatch.setattr(LightCurve, setting, value)
+  cached_features(str(tmp_path), arrays, compute)
+  assert compute.calls == 2
+
+def test_changed_input_byte_misses(tmp_path, arrays):
+  compute = counting(np.zeros((6, 2)))
+  cached_features(str(tmp_path), arrays, compute)
+  flux = arrays[2].copy()
+  flux.reshape(-1).view(np.uint8)[123] ^= 1
+  cached_features(str(tmp_path), arrays[:2] + [flux], compute)
+  assert compute.calls == 2
+  cached_features(str(tmp_path), arrays, compute)
+  assert compute.calls == 2
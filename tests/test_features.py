@@ -0,0 +1,38 @@
+"""
+Batch feature extraction against LightCurve.calculate_inputs, curve by curve.
+"""
+
+import numpy as np
+import pytest
+from lightcurve import LightCurve, NonEvent, MicroLensing, Periodic, generate_batch, filter_batch
+from features import batch_inputs
+
+TYPES = [NonEvent, MicroLensing, Periodic]
+
+@pytest.fixture(scope='module')
+def batch():
+  rng = np.random.default_rng(3)
+  curves, labels, _ = generate_batch(TYPES, 12, 300, rng)
+  mask = filter_batch(curves, labels, rng)
+  return curves, mask
+
+def object_inputs(curve, keep, names=None):
+  """ calculate_inputs of the kept samples of one curve. """
+  lightcurve = LightCurve()
+  lightcurve.load_curve(curve[keep, LightCurve.CURVE_X], curve[keep, LightCurve.CURVE_Y], curve[keep, LightCurve.CURVE_SIGMA])
+  return lightcurve.calculate_inputs(names).ravel()
+
+def test_batch_inputs_match_calculate_inputs(batch):
+  curves, mask = batch
+  inputs = batch_inputs(curves, mask, chunk_size=5)
+  assert inputs.shape == (len(curves), LightCurve.INPUT_SIZE)
+  for row, curve, keep in zip(inputs, curves, mask):
+    np.testing.assert_allclose(row, object_inputs(curve, keep), rtol=1e-7, atol=1e-9)
+
+def test_input_subsets_match_full_inputs(batch):
+  curves, mask = batch
+  names = ['power_mean', 'ac_symm_max', 'noise_est']
+  full = batch_inputs(curves, mask)
+  subset = batch_inputs(curves, mask, names)
+  np.testing.assert_array_equal(subset, full[:, [LightCurve.INPUT_NAMES.index(name) for name in names]])
+  np.testing.assert_allclose(subset[0], object_inputs(curves[0], mask[0], names), rtol=1e-7, atol=1e-9)
@@ -0,0 +1,83 @@
+"""
+Array-level filters against the per-sample loops of the original LightCurve
+filters, and single curves against batches.
+"""
+
+import random
+import numpy as np
+import pytest
+import filters
+from filters import noise_sigma, patchy_mask, dips
+
+SIZE = 200
+TRIALS = 3000
+
+def patchy_loop(size, rand):
+  """ Keep mask of the original LightCurve.patchy_filter. """
+  remove = []
+  skip = 0
+  for i in range(size):
+    if skip > 0:
+      skip -= 1
+    if rand.randint(0, 4) < 3 or skip > 0:
+      remove.append(i)
+      continue
+    if rand.randint(0, 14) == 0:
+      skip = rand.randint(0, 30)
+  keep = np.ones(size, dtype=bool)
+  keep[remove] = False
+  return keep
+
+def test_patchy_mask_matches_the_loop_in_distribution():
+  rand = random.Random(2)
+  loop = np.array([patchy_loop(SIZE, rand) for _ in range(TRIALS)])
+  mask = patchy_mask((TRIALS, SIZE), np.random.default_rng(2))
+  assert mask.shape == loop.shape and mask.dtype == bool
+
+  loop_count, mask_count = loop.sum(axis=1), mask.sum(axis=1)
+  error = loop_count.std() / np.sqrt(TRIALS)
+  assert abs(mask_count.mean() - loop_count.mean()) < 5 * np.sqrt(2) * error
+  assert mask_count.std() == pytest.approx(loop_count.std(), rel=0.1)
+
+  # Keep rates at both ends, where a gap cannot have started or may run off
+  for edge in [slice(0, 5), slice(SIZE - 5, SIZE)]:
+    rate_error = np.sqrt(0.4 * 0.6 / (5 * TRIALS))
+    assert abs(mask[:, edge].mean() - loop[:, edge].mean()) < 5 * np.sqrt(2) * rate_error
+
+def test_dips_hit_only_kept_samples():
+  rng = np.random.default_rng(4)
+  clean = np.full((50, SIZE), 10.0)
+  mask = patchy_mask(clean.shape, rng)
+  flux = dips(clean, clean, rng, mask)
+  hit = flux != clean
+  assert hit.any()
+  assert not (hit & ~mask).any()
+
+def test_dip_depth_follows_the_kept_clean_flux(monkeypatch):
+  monkeypatch.setattr(filters, 'MAX_DIPS', 1)
+  rng = np.random.default_rng(5)
+  mask = patchy_mask((200, SIZE), rng)
+  # Removed samples are far brighter, they must not move the dip depth
+  clean = np.where(mask, 10.0, 1000.0)
+  depth = (clean - dips(clean, clean, rng, mask))[mask]
+  depth = depth[depth != 0]
+  assert len(depth) > 0
+  assert depth.min() >= 6 and depth.max() <= 12
+
+def test_single_curves_match_batches_of_one():
+  rng = np.random.default_rng(7)
+  clean = rng.uniform(5, 20, SIZE)
+  mask = patchy_mask(SIZE, rng)
+  assert mask.shape == (SIZE,) and patchy_mask((3, SIZE), rng).shape == (3, SIZE)
+
+  single = noise_sigma(clean, np.random.default_rng(8))
+  batch = noise_sigma(clean[None], np.random.default_rng(8))
+  for curve, rows in zip(single, batch):
+    assert curve.shape == (SIZE,) and rows.shape == (1, SIZE)
+    np.testing.assert_array_equal(curve, rows[0])
+
+  noisy = single[0]
+  curve = dips(noisy, clean, np.random.default_rng(9), mask)
+  rows = dips(noisy[None], clean[None], np.random.default_rng(9), mask[None])
+  assert curve.shape == (SIZE,) and rows.shape == (1, SIZE)
+  np.testing.assert_array_equal(curve, rows[0])
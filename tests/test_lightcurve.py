@@ -0,0 +1,50 @@
+"""
+The batch generator against LightCurve.generate_curve: for the same parameters the
+curves of generate_batch are the noise-free curves of the per-object classes.
+"""
+
+import numpy as np
+import pytest
+from lightcurve import LightCurve, NonEvent, MicroLensing, Periodic, generate_batch, OUTPUT_TYPES
+
+# Name of the parameter each class draws in generate_curve rather than in generate_params
+CURVE_PARAMS = {NonEvent: None, MicroLensing: 'shift', Periodic: 'phase'}
+
+class FixedDraw:
+  """ Stands in for the generator of an object whose parameters are all given:
+  the only draw left is the one generate_curve makes. """
+
+  def __init__(self, value):
+    self.value = value
+
+  def uniform(self, low, high):
+    return self.value
+
+def object_curve(curve_type, params, i, size):
+  """ The unfiltered curve generate_curve produces for row ``i`` of ``params``. """
+  curve_param = CURVE_PARAMS[curve_type]
+  names = [name for name in params if name != curve_param]
+  rng = FixedDraw(params[curve_param][i] if curve_param else None)
+  curve = curve_type(**{name: params[name][i] for name in names}, rng=rng)
+  curve.size = size
+  curve.apply_filters = lambda: curve.curve
+  curve.generate_curve()
+  return curve.curve
+
+@pytest.mark.parametrize('curve_type', [NonEvent, MicroLensing, Periodic])
+def test_generate_batch_matches_generate_curve(curve_type):
+  size = 200
+  curves, params = curve_type.generate_batch(5, size, np.random.default_rng(1))
+  assert curves.shape == (5, size, 5)
+  for i in range(5):
+    expected = object_curve(curve_type, params, i, size)
+    for column in [LightCurve.CURVE_X, LightCurve.CURVE_Y]:
+      np.testing.assert_allclose(curves[i, :, column], expected[:, column], rtol=1e-12)
+
+def test_generate_batch_labels_and_params():
+  curves, labels, params = generate_batch([MicroLensing, Periodic], 50, 100, np.random.default_rng(2))
+  assert set(labels) <= {OUTPUT_TYPES.index(MicroLensing), OUTPUT_TYPES.index(Periodic)}
+  microlensing = labels == OUTPUT_TYPES.index(MicroLensing)
+  assert not np.isnan(params['uo'][microlensing]).any()
+  assert np.isnan(params['uo'][~microlensing]).all()
+  np.testing.assert_array_equal(curves[:, :, LightCurve.CURVE_Y], curves[:, :, LightCurve.CURVE_Y_CLEAN])
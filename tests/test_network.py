@@ -0,0 +1,198 @@
+"""
+The batched network code against the per-sample code of the original Network.
+"""
+
+import numpy as np
+import pytest
+from network import Network, CrossEntropyCost, QuadraticCost, sigmoid, load, load_binary, convert
+from network import Ensemble, vote_fractions, majority_vote, Momentum, Adam, save_optimizer, load_optimizer, ExponentialDecay, StepDecay, InverseTimeDecay
+
+SIZES = [6, 5, 4, 3]
+
+def make_network(cost=CrossEntropyCost, dtype=np.float64, seed=0):
+  np.random.seed(seed)
+  return Network(SIZES, cost=cost, dtype=dtype)
+
+def make_data(m, seed=1):
+  """ ``m`` random inputs and one-hot outputs, one sample per row. """
+  rng = np.random.default_rng(seed)
+  x = rng.normal(size=(m, SIZES[0]))
+  y = np.eye(SIZES[-1])[rng.integers(0, SIZES[-1], m)]
+  return x, y
+
+@pytest.mark.parametrize('cost', [CrossEntropyCost, QuadraticCost])
+def test_backprop_batch_sums_backprop(cost):
+  nn = make_network(cost)
+  x, y = make_data(7)
+  nabla_b, nabla_w = nn.backprop_batch(x.transpose(), y.transpose())
+  samples = [nn.backprop(xi.reshape(-1, 1), yi.reshape(-1, 1)) for xi, yi in zip(x, y)]
+  for l in range(len(SIZES) - 1):
+    np.testing.assert_allclose(nabla_b[l], sum(b[l] for b, _ in samples), rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(nabla_w[l], sum(w[l] for _, w in samples), rtol=1e-12, atol=1e-14)
+
+def test_predict_batch_matches_feedforward():
+  nn = make_network()
+  x, _ = make_data(9)
+  outputs = nn.predict_batch(x)
+  for xi, output in zip(x, outputs):
+    np.testing.assert_allclose(output, nn.feedforward(xi.reshape(-1, 1)).ravel(), rtol=1e-12)
+
+@pytest.mark.parametrize('convert', [False, True])
+def test_accuracy_and_cost_match_per_sample_loops(convert):
+  nn = make_network()
+  x, y = make_data(20)
+  labels = np.argmax(y, axis=1)
+  if convert:
+    accuracy_data = [(xi.reshape(-1, 1), yi.reshape(-1, 1)) for xi, yi in zip(x, y)]
+    cost_data = [(xi.reshape(-1, 1), label) for xi, label in zip(x, labels)]
+  else:
+    accuracy_data = [(xi.reshape(-1, 1), label) for xi, label in zip(x, labels)]
+    cost_data = [(xi.reshape(-1, 1), yi.reshape(-1, 1)) for xi, yi in zip(x, y)]
+
+  outputs = [nn.feedforward(xi.reshape(-1, 1)) for xi in x]
+  assert nn.accuracy(accuracy_data, convert=convert) == sum(int(np.argmax(a) == label) for a, label in zip(outputs, labels))
+
+  lmbda = 0.1
+  expected = sum(nn.cost.fn(a, yi.reshape(-1, 1)) / len(x) for a, yi in zip(outputs, y))
+  expected += 0.5 * lmbda * sum(np.linalg.norm(w)**2 for w in nn.weights)
+  assert nn.total_cost(cost_data, lmbda, convert=convert) == pytest.approx(expected, rel=1e-12)
+
+def reference_step(nn, x, y, eta, lmbda, n):
+  """ The original update_mini_batch: per-sample backprop, then a gradient step
+  after the weight decay. Returns the new weights and biases. """
+  samples = [nn.backprop(xi.reshape(-1, 1), yi.reshape(-1, 1)) for xi, yi in zip(x, y)]
+  m = len(x)
+  weights = [(1-eta*(lmbda/n))*w - (eta/m)*sum(s[1][l] for s in samples) for l, w in enumerate(nn.weights)]
+  biases = [b - (eta/m)*sum(s[0][l] for s in samples) for l, b in enumerate(nn.biases)]
+  return weights, biases
+
+def test_workspace_update_matches_per_sample_update():
+  nn = make_network()
+  x, y = make_data(12)
+  # A full mini batch, then a shorter one reusing the same workspace
+  for rows in [np.arange(8), np.array([9, 2, 11])]:
+    weights, biases = reference_step(nn, x[rows], y[rows], 0.5, 0.2, 12)
+    nn.update_mini_batch_rows(x, y, rows, 0.5, 0.2, 12)
+    for ours, theirs in zip(nn.weights + nn.biases, weights + biases):
+      np.testing.assert_allclose(ours, theirs, rtol=1e-12, atol=1e-14)
+
+def test_float32_training_follows_float64():
+  x, y = make_data(40)
+  nets = {dtype: make_network(dtype=dtype) for dtype in [np.float64, np.float32]}
+  for dtype, nn in nets.items():
+    np.random.seed(2)
+    nn.train_rows(x, y, 3, 10, 0.5, 0.1)
+    assert all(w.dtype == dtype for w in nn.weights + nn.biases)
+  for ours, theirs in zip(nets[np.float32].weights, nets[np.float64].weights):
+    np.testing.assert_allclose(ours, theirs, rtol=1e-3, atol=1e-4)
+
+def test_sigmoid_accepts_scalars_and_integer_arrays():
+  assert sigmoid(0.0) == 0.5
+  np.testing.assert_allclose(sigmoid(np.array([1, 2])), 1/(1+np.exp(-np.array([1.0, 2.0]))))
+  out = np.empty(2, dtype=np.float32)
+  with np.errstate(over='raise'):
+    assert sigmoid(np.array([-1000.0, 0.0], dtype=np.float32), out=out) is out
+  np.testing.assert_array_equal(out, [0.0, 0.5])
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('mmap', [True, False])
+def test_binary_round_trip(tmp_path, dtype, mmap):
+  nn = make_network(QuadraticCost, dtype)
+  nn.inputs = ['ac_width', 'noise_est', 'power_peak', 'slope', 'ac_max', 'power_mean']
+  nn.feature_version = 2
+  nn.save_binary(str(tmp_path / 'nn.nnb'))
+  loaded = load_binary(str(tmp_path / 'nn.nnb'), mmap=mmap)
+  assert (loaded.sizes, loaded.cost, loaded.inputs, loaded.feature_version, loaded.dtype) == \
+         (nn.sizes, nn.cost, nn.inputs, nn.feature_version, nn.dtype)
+  for ours, theirs in zip(loaded.weights + loaded.biases, nn.weights + nn.biases):
+    assert ours.dtype == dtype
+    np.testing.assert_array_equal(ours, theirs)
+
+def test_json_converts_to_the_same_binary_network(tmp_path):
+  nn = make_network()
+  nn.save(str(tmp_path / 'nn.json'))
+  converted = load(convert(str(tmp_path / 'nn.json')))
+  x, _ = make_data(5)
+  np.testing.assert_array_equal(converted.predict_batch(x), nn.predict_batch(x))
+
+def optimizer_steps(optimizer, params, gradients, eta):
+  """ Runs ``optimizer`` over the gradient sequence, on copies since it uses the
+  gradients as scratch space. """
+  params = [p.copy() for p in params]
+  for grads in gradients:
+    optimizer.step(params, [g.copy() for g in grads], eta)
+  return params
+
+def random_steps(steps, seed=2):
+  rng = np.random.default_rng(seed)
+  params = [rng.normal(size=(5, 6)), rng.normal(size=(5, 1))]
+  gradients = [[rng.normal(size=p.shape) for p in params] for _ in range(steps)]
+  return params, gradients
+
+def test_nesterov_momentum_follows_the_look_ahead_formula():
+  params, gradients = random_steps(6)
+  mu, eta = 0.8, 0.05
+  expected = [p.copy() for p in params]
+  velocities = [np.zeros_like(p) for p in params]
+  for grads in gradients:
+    for p, v, g in zip(expected, velocities, grads):
+      v[:] = mu * v - eta * g
+      p += mu * v - eta * g
+  for ours, theirs in zip(optimizer_steps(Momentum(mu, nesterov=True), params, gradients, eta), expected):
+    np.testing.assert_allclose(ours, theirs, rtol=1e-12)
+
+def test_adam_follows_the_bias_corrected_formula():
+  params, gradients = random_steps(6)
+  beta1, beta2, epsilon, eta = 0.9, 0.99, 1e-3, 0.01
+  expected = [p.copy() for p in params]
+  moments = [(np.zeros_like(p), np.zeros_like(p)) for p in params]
+  for t, grads in enumerate(gradients, 1):
+    for p, (m, v), g in zip(expected, moments, grads):
+      m[:] = beta1 * m + (1 - beta1) * g
+      v[:] = beta2 * v + (1 - beta2) * g**2
+      p -= eta * (m / (1 - beta1**t)) / (np.sqrt(v / (1 - beta2**t)) + epsilon)
+  for ours, theirs in zip(optimizer_steps(Adam(beta1, beta2, epsilon), params, gradients, eta), expected):
+    np.testing.assert_allclose(ours, theirs, rtol=1e-12)
+
+@pytest.mark.parametrize('optimizer', [Momentum(0.7, nesterov=True), Adam(0.8, 0.95)])
+def test_optimizer_round_trip_resumes_the_same_steps(tmp_path, optimizer):
+  params, gradients = random_steps(5)
+  params = optimizer_steps(optimizer, params, gradients[:3], 0.1)
+  save_optimizer(optimizer, str(tmp_path / 'optimizer.npz'))
+  loaded = load_optimizer(str(tmp_path / 'optimizer.npz'))
+  assert type(loaded) is type(optimizer)
+  assert (loaded.t, loaded.config()) == (optimizer.t, optimizer.config())
+  assert getattr(loaded, 'nesterov', None) == getattr(optimizer, 'nesterov', None)
+  for ours, theirs in zip(loaded.state, optimizer.state):
+    for a, b in zip(ours, theirs):
+      np.testing.assert_array_equal(a, b)
+  for ours, theirs in zip(optimizer_steps(loaded, params, gradients[3:], 0.1), optimizer_steps(optimizer, params, gradients[3:], 0.1)):
+    np.testing.assert_array_equal(ours, theirs)
+
+def test_learning_rate_schedules():
+  halving = ExponentialDecay(0.1, 100)
+  assert [halving(t) for t in [0, 100, 200]] == pytest.approx([0.1, 0.05, 0.025])
+  steps = StepDecay(0.1, 0.5, 10)
+  assert [steps(t) for t in [0, 9, 10, 25]] == pytest.approx([0.1, 0.1, 0.05, 0.025])
+  inverse = InverseTimeDecay(0.1, 50)
+  assert [inverse(t) for t in [0, 50, 150]] == pytest.approx([0.1, 0.05, 0.025])
+
+def test_ensemble_predict_batch_matches_each_network():
+  networks = [make_network(seed=seed) for seed in range(3)]
+  x, _ = make_data(8)
+  outputs = Ensemble(networks).predict_batch(x)
+  assert outputs.shape == (3, 8, SIZES[-1])
+  for output, nn in zip(outputs, networks):
+    np.testing.assert_allclose(output, nn.predict_batch(x), rtol=1e-12)
+
+def test_tied_models_split_their_vote():
+  # One sample, three models: the third has a two-way tie at its top
+  outputs = np.array([[[0.9, 0.1, 0.2]], [[0.1, 0.8, 0.2]], [[0.7, 0.7, 0.1]]])
+  np.testing.assert_allclose(vote_fractions(outputs), [[0.5, 0.5, 0]])
+
+def test_vote_ties_go_to_the_highest_mean_output():
+  # Class 1 wins the tied vote on its mean output, class 0 on a plain argmax
+  outputs = np.array([[[0.6, 0.5, 0.0], [0.2, 0.3, 0.9]],
+                      [[0.1, 0.9, 0.0], [0.4, 0.3, 0.1]]])
+  np.testing.assert_allclose(vote_fractions(outputs), [[0.5, 0.5, 0], [0.5, 0, 0.5]])
+  assert majority_vote(outputs).tolist() == [1, 2]
@@ -0,0 +1,61 @@
+"""
+Data-parallel training against single-process training on the same curves.
+"""
+
+import numpy as np
+import pytest
+from network import Network
+from parallel import ParallelTrainer
+from lightcurve import LightCurve, MicroLensing, NonEvent, Periodic, generate_batch, filter_batch, expected_outputs_batch
+from features import batch_inputs
+
+TYPES = [MicroLensing, NonEvent, Periodic]
+SIZES = [LightCurve.INPUT_SIZE, 5, LightCurve.OUTPUT_SIZE]
+
+def worker_data(seed, local_samples):
+  """ The curves and row order a worker seeded with ``seed`` trains on in its
+  first epoch, drawn as worker_process draws them. """
+  rng = np.random.default_rng(seed)
+  curves, labels, _ = generate_batch(TYPES, local_samples, rng=rng)
+  mask = filter_batch(curves, labels, rng)
+  x = batch_inputs(curves, mask)
+  return x, expected_outputs_batch(labels), rng.permutation(len(x))
+
+# Workers, samples per step and mini batch size. Each worker's share is
+# mini_batch_size // workers rows and the last share of an epoch is shorter
+@pytest.mark.parametrize('workers, samples, mini_batch_size', [(2, 10, 6), (3, 20, 12)])
+def test_sync_step_matches_single_process_update(workers, samples, mini_batch_size):
+  np.random.seed(0)
+  nn = Network(SIZES)
+  reference = nn.copy()
+  seeds = np.random.SeedSequence(1).spawn(workers)
+  trainer = ParallelTrainer(nn, workers, TYPES, samples, mini_batch_size, 1, 0.5, lmbda=0.1, mode='sync', seeds=seeds)
+  try:
+    trainer.step()
+  finally:
+    trainer.close()
+
+  local_samples, local_batch = samples // workers, mini_batch_size // workers
+  assert local_samples % local_batch, "the case must include a short last share"
+  data = [worker_data(seed, local_samples) for seed in seeds]
+  x = np.concatenate([x for x, _, _ in data])
+  y = np.concatenate([y for _, y, _ in data])
+  for k in range(0, local_samples, local_batch):
+    rows = np.concatenate([order[k:k + local_batch] + i * local_samples for i, (_, _, order) in enumerate(data)])
+    reference.update_mini_batch_rows(x, y, rows, 0.5, 0.1, samples)
+
+  for ours, theirs in zip(nn.weights + nn.biases, reference.weights + reference.biases):
+    np.testing.assert_allclose(ours, theirs, rtol=1e-12, atol=1e-14)
+
+def test_hogwild_step_updates_shared_weights():
+  np.random.seed(0)
+  nn = Network(SIZES)
+  before = [w.copy() for w in nn.weights]
+  trainer = ParallelTrainer(nn, 2, TYPES, 20, 5, 1, 0.5, mode='hogwild', seeds=np.random.SeedSequence(2).spawn(2))
+  try:
+    generated, accuracy = trainer.step()
+  finally:
+    trainer.close()
+  assert generated >= 20
+  assert 0 <= accuracy <= 1
+  assert any(not np.array_equal(w, b) for w, b in zip(nn.weights, before))
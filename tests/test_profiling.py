@@ -0,0 +1,46 @@
+"""
+Profiling statistics gathered in several processes and merged in one.
+"""
+
+import pytest
+import profiling
+from profiling import record, snapshot, merge, SAMPLE_LIMIT
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+  monkeypatch.setattr(profiling, '_stats', {})
+  profiling._sampler.seed(10)
+
+def test_merged_samples_follow_the_call_counts():
+  for _ in range(100000):
+    record('fit', 1.0)
+  worker = snapshot(reset=True)
+  for _ in range(10000):
+    record('fit', 2.0)
+  merge(worker)
+
+  stats = snapshot()['fit']
+  assert (stats['count'], stats['total']) == (110000, 120000.0)
+  assert len(stats['samples']) == SAMPLE_LIMIT
+  # A sample of 10000 from each side, weighted by the 100000 and 10000 calls behind them
+  assert stats['samples'].count(1.0) / SAMPLE_LIMIT == pytest.approx(100000 / 110000, abs=0.01)
+
+def test_snapshot_reset_and_merge_totals():
+  record('features', 0.5, 100)
+  record('features', 0.25, 300)
+  record('network', 0.125)
+  worker = snapshot(reset=True)
+  assert snapshot() == {}
+
+  record('features', 1.0, 200)
+  merge(worker)
+  stats = snapshot()
+  assert {key: stats['features'][key] for key in ['count', 'total', 'size_count', 'size_total', 'size_max']} == \
+         {'count': 3, 'total': 1.75, 'size_count': 3, 'size_total': 600, 'size_max': 300}
+  assert sorted(stats['features']['samples']) == [0.25, 0.5, 1.0]
+  assert (stats['network']['count'], stats['network']['total'], stats['network']['size_count']) == (1, 0.125, 0)
+
+  # Merged and unreset snapshots are copies, not views of the other's statistics
+  worker['network']['samples'].append(9.0)
+  stats['network']['samples'].append(9.0)
+  assert snapshot()['network']['samples'] == [0.125]
@@ -0,0 +1,77 @@
+"""
+The fast correlation, periodogram and excursion engines against the direct
+computations they replace.
+"""
+
+import numpy as np
+import pytest
+from scipy import signal
+from lightcurve import LightCurve, NonEvent, MicroLensing, Periodic, generate_batch, filter_batch
+from raw_nodes import pspec, fast_lombscargle, excursion, excursion_batch
+
+def excursion_loop(mags):
+  """ The original excursion, splitting the normalised magnitudes in lists. """
+  normalised_mags = (mags - min(mags)) / (max(mags) - min(mags))
+  normalised_mean = np.mean(normalised_mags)
+  above, below = [], []
+  for mag in normalised_mags:
+    if mag >= normalised_mean:
+      above.append(mag)
+    else:
+      below.append(mag)
+  above_range = np.percentile(above, 99) - np.percentile(above, 1)
+  below_range = np.percentile(below, 99) - np.percentile(below, 1)
+  return above_range - below_range, above_range, below_range
+
+def filtered_curve(curve_type, seed):
+  curve = curve_type(rng=np.random.default_rng(seed))
+  curve.size = 400
+  curve.generate_curve()
+  return curve.curve
+
+@pytest.mark.parametrize('curve_type', [MicroLensing, Periodic])
+@pytest.mark.parametrize('rev', [False, True])
+def test_fft_autocorrelation_matches_direct(monkeypatch, curve_type, rev):
+  data = filtered_curve(curve_type, 4)
+  results = {}
+  for backend in ['direct', 'fft']:
+    monkeypatch.setattr(LightCurve, 'AC_BACKEND', backend)
+    lightcurve = LightCurve()
+    lightcurve.load_curve(data[:, LightCurve.CURVE_X], data[:, LightCurve.CURVE_Y], data[:, LightCurve.CURVE_SIGMA])
+    results[backend] = lightcurve.autocorrelate(rev)
+  np.testing.assert_allclose(results['fft'], results['direct'], rtol=1e-9, atol=1e-12)
+
+@pytest.mark.parametrize('curve_type', [MicroLensing, Periodic])
+@pytest.mark.parametrize('seed', range(3))
+def test_fast_pspec_matches_exact(curve_type, seed):
+  data = filtered_curve(curve_type, seed)[:, :2]
+  exact_power, exact_freq = pspec(data, 'exact')
+  fast_power, fast_freq = pspec(data, 'fast')
+  assert fast_freq == exact_freq
+  # The extirpolation error is largest near the highest frequencies, about 1%
+  assert fast_power == pytest.approx(exact_power, rel=2e-2)
+
+def test_fast_lombscargle_matches_scipy():
+  data = filtered_curve(Periodic, 5)
+  times, flux = data[:, 0], data[:, 1] - np.mean(data[:, 1])
+  # Below the Nyquist frequency of the unit time step, where the periodogram is well conditioned
+  ang_freqs = 2 * np.pi / np.linspace(2.5, 20, 200)
+  exact = signal.lombscargle(times, flux, ang_freqs, normalize=True)
+  np.testing.assert_allclose(fast_lombscargle(times, flux, ang_freqs), exact, atol=5e-3 * exact.max())
+
+@pytest.mark.parametrize('curve_type', [NonEvent, MicroLensing, Periodic])
+def test_excursion_matches_loop(curve_type):
+  for seed in range(3):
+    data = filtered_curve(curve_type, seed)
+    np.testing.assert_allclose(excursion(data[:, :2]), excursion_loop(data[:, 1]), rtol=1e-12, atol=1e-15)
+
+def test_masked_excursion_batch_matches_loop():
+  rng = np.random.default_rng(8)
+  curves, labels, _ = generate_batch([NonEvent, MicroLensing, Periodic], 12, 300, rng)
+  mask = filter_batch(curves, labels, rng)
+  mags = curves[:, :, LightCurve.CURVE_Y]
+  # Samples removed by the filters must not count, whatever they hold
+  mags[~mask] = 1e6
+  results = np.stack(excursion_batch(mags, mask), axis=1)
+  for row, curve, keep in zip(results, mags, mask):
+    np.testing.assert_allclose(row, excursion_loop(curve[keep]), rtol=1e-12, atol=1e-15)
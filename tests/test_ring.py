@@ -0,0 +1,81 @@
+"""
+The shared-memory ring between generation workers and the trainer, with real
+writer processes.
+"""
+
+import time
+import numpy as np
+import pytest
+import multiprocessing as mp
+from ring import Ring
+
+BLOCK_ROWS = 3
+
+def writer(ring, writer_id, count, done):
+  """ Writes ``count`` blocks whose every row holds ``(writer_id, sequence)``,
+  counting finished puts in ``done``. """
+  for sequence in range(count):
+    x = np.tile([writer_id, sequence], (BLOCK_ROWS, 1))
+    ring.put(x, np.full((BLOCK_ROWS, 1), writer_id))
+    with done.get_lock():
+      done.value += 1
+
+@pytest.fixture
+def ring():
+  ring = Ring(2, 1, BLOCK_ROWS, 4)
+  yield ring
+  ring.close()
+
+def test_every_block_is_read_once_in_claim_order(ring):
+  done = mp.Value('i', 0)
+  writers = [mp.Process(target=writer, args=(ring, i, 10, done)) for i in range(2)]
+  for process in writers:
+    process.start()
+
+  seen = []
+  for _ in range(10):
+    x, y = ring.get(2)
+    assert x.shape == (2 * BLOCK_ROWS, 2) and y.shape == (2 * BLOCK_ROWS, 1)
+    # One contiguous view of the ring
+    assert np.shares_memory(x, ring.x)
+    for block in range(2):
+      rows = x[block * BLOCK_ROWS:(block + 1) * BLOCK_ROWS]
+      # A complete block is written by one put
+      assert (rows == rows[0]).all() and (y[block * BLOCK_ROWS:(block + 1) * BLOCK_ROWS] == rows[0, 0]).all()
+      seen.append(tuple(rows[0].astype(int)))
+    ring.release(2)
+
+  for process in writers:
+    process.join(5)
+  assert sorted(seen) == [(i, sequence) for i in range(2) for sequence in range(10)]
+  # Each writer claims its blocks in turn, so claim order keeps its sequence
+  for i in range(2):
+    assert [sequence for writer_id, sequence in seen if writer_id == i] == list(range(10))
+
+def test_writers_wait_while_the_ring_is_full(ring):
+  done = mp.Value('i', 0)
+  process = mp.Process(target=writer, args=(ring, 0, 6, done))
+  process.start()
+  time.sleep(0.5)
+  assert done.value == 4
+  assert ring.occupancy() == 1.0
+
+  x, _ = ring.get(2)
+  assert x[:, 1].tolist() == [0] * BLOCK_ROWS + [1] * BLOCK_ROWS
+  time.sleep(0.2)
+  # Reading alone frees nothing, the blocks are still in use
+  assert done.value == 4
+  ring.release(2)
+  process.join(5)
+  assert done.value == 6
+  # Reads keep one batch size, so batches stay aligned with the ring
+  sequences = []
+  for _ in range(2):
+    x, _ = ring.get(2)
+    sequences += x[::BLOCK_ROWS, 1].astype(int).tolist()
+    ring.release(2)
+  assert sequences == [2, 3, 4, 5]
+
+def test_get_requires_batches_that_tile_the_ring(ring):
+  with pytest.raises(ValueError):
+    ring.get(3)
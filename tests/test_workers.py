@@ -0,0 +1,47 @@
+"""
+Generation workers: every worker of every start draws its own stream, and
+telemetry slots pass from exited workers to their replacements.
+"""
+
+import numpy as np
+import pytest
+import multiprocessing as mp
+from telemetry import Telemetry
+from train import worker_seed
+
+def draws(seed, start_iteration, slot, restarts=0):
+  return np.random.default_rng(worker_seed(seed, start_iteration, slot, restarts)).integers(0, 2**62, 4).tolist()
+
+def test_worker_streams_differ_and_reproduce():
+  streams = [draws(7, start, slot, restarts) for start in [0, 5000] for slot in range(3) for restarts in range(3)]
+  assert len(set(map(tuple, streams))) == len(streams)
+  assert draws(7, 5000, 2) == draws(7, 5000, 2)
+  assert draws(7, 5000, 2, 1) == draws(7, 5000, 2, 1)
+  assert draws(7, 5000, 2) != draws(8, 5000, 2)
+
+def hold_slot(telemetry, slots, release):
+  telemetry.register()
+  slots.put((telemetry.slot, telemetry.restarts))
+  if release is not None:
+    release.wait(10)
+
+def test_register_reuses_the_slots_of_exited_workers(tmp_path):
+  telemetry = Telemetry(2, path=str(tmp_path / 'metrics.jsonl'))
+  slots, release = mp.Queue(), mp.Event()
+  holder = mp.Process(target=hold_slot, args=(telemetry, slots, release))
+  holder.start()
+  try:
+    assert slots.get(timeout=10) == (0, 0)
+    exited = mp.Process(target=hold_slot, args=(telemetry, slots, None))
+    exited.start()
+    assert slots.get(timeout=10) == (1, 0)
+    exited.join(10)
+
+    telemetry.register()
+    assert (telemetry.slot, telemetry.restarts) == (1, 1)
+    # This process and the holder keep both slots
+    with pytest.raises(RuntimeError):
+      telemetry.register()
+  finally:
+    release.set()
+    holder.join(10)
@@ -8,13 +8,26 @@ import numpy as np
 import random
 import time
 from lightcurve import *
-from network import Network
-import matplotlib.patheffects as PathEffects
+from network import Network, OPTIMIZERS, ExponentialDecay
+from features import batch_inputs
+import profiling
+import queue
 import multiprocessing as mp
 import datetime
+import argparse
+from parallel import ParallelTrainer, MODES
+from evaluation import Evaluator
+from ring import Ring
+from telemetry import Telemetry, BUSY, BLOCKED
+from corpus import Corpus
+from render import watch, human_format
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, restore_rng
 
 plot = None
 
+# Seconds between profiling snapshots sent by each generation worker
+PROFILE_REPORT_INTERVAL = 10
+
 def draw_plot(event):
   global plot, ax1, eline
   time_list, mag_list, sigma, no_noise_time, no_noise = np.split(event.curve, 5, 1)
@@ -41,182 +54,191 @@ def draw_plot(event):
   ax1.set_title(event.name)
   return event
 
-def draw_neural_net(ax, left, right, bottom, top, nn, activations=None, layer_text=None):
-  '''
-  Draw a neural network cartoon using matplotilb.
-
-  :usage:
-      >>> fig = plt.figure(figsize=(12, 12))
-      >>> draw_neural_net(fig.gca(), .1, .9, .1, .9, [4, 7, 2], ['x1', 'x2','x3','x4'])
-
-  :parameters:
-      - ax : matplotlib.axes.AxesSubplot
-          The axes on which to plot the cartoon (get e.g. by plt.gca())
-      - left : float
-          The center of the leftmost node(s) will be placed here
-      - right : float
-          The center of the rightmost node(s) will be placed here
-      - bottom : float
-          The center of the bottommost node(s) will be placed here
-      - top : float
-          The center of the topmost node(s) will be placed here
-      - layer_sizes : list of int
-          List of layer sizes, including input and output dimensionality
-      - layer_text : list of str
-          List of node annotations in top-down left-right order
-  '''
-  text = layer_text[:]
-  layer_sizes = nn.sizes
-  weights = nn.weights
-
-  n_layers = len(layer_sizes)
-  v_spacing = (top - bottom)/float(max(layer_sizes))
-  h_spacing = (right - left)/float(len(layer_sizes) - 1)
-  ax.axis('off')
-
-  if activations:
-    act_flatten = []
-    for n in range(len(layer_sizes)):
-      for m in range(layer_sizes[n]):
-        act_flatten.append(activations[n][m])
-    max_act = max(act_flatten)
-
-  # Nodes
-  for n, layer_size in enumerate(layer_sizes):
-    layer_top = v_spacing*(layer_size - 1)/2. + (top + bottom)/2.
-    for m in range(layer_size):
-      x = n*h_spacing + left
-      y = layer_top - m*v_spacing
-
-      col = "#FFFFFFFF"
-
-      if activations:
-        col = "%x" % int((activations[n][m] / max_act) * 15)
-        col = '#'+col*6+'FF'
-
-      circle = plt.Circle((x,y), v_spacing/4., color=col, ec='k', zorder=0)
-      ax.add_artist(circle)
-
-      # Node annotations
-      if text:
-        string = text.pop(0)
-        txt = ax.text(x, y, string, ha='center', va='center')
-        txt.set_path_effects([PathEffects.withStroke(linewidth=5, foreground='w')])
-
-  green = "55BB55FF"
-  red = "BB5555FF"
-
-  # Edges
-  for n, (layer_size_a, layer_size_b) in enumerate(zip(layer_sizes[:-1], layer_sizes[1:])):
-    layer_top_a = v_spacing*(layer_size_a - 1)/2. + (top + bottom)/2.
-    layer_top_b = v_spacing*(layer_size_b - 1)/2. + (top + bottom)/2.
-    for m in range(layer_size_a):
-      for o in range(layer_size_b):
-        weight = weights[n][o][m]
-        col = green if weight > 0 else red
-        line = plt.Line2D([n*h_spacing + left, (n + 1)*h_spacing + left], [layer_top_a - m*v_spacing, layer_top_b - o*v_spacing], c='#'+col, zorder=-1, linewidth=min(abs(weight), 5))
-        ax.add_artist(line)
-
-def get_event(types):
-  event = types[random.randint(0, len(types)-1)]()
+def get_event(types, rng):
+  event = types[rng.integers(0, len(types))](rng=rng)
   event.generate_curve()
   return event
 
-def generation_process(q, types):
+def worker_seed(seed, start_iteration, slot, restarts=0):
+  """ Seed of the generator of worker ``slot`` in a run seeded with ``seed`` that
+  started (or resumed) at ``start_iteration``, after ``restarts`` earlier
+  processes held the slot. Every worker of every start draws an independent
+  stream, including one that replaces a worker that died. """
+  return np.random.SeedSequence(seed, spawn_key=(start_iteration, slot) + ((restarts,) if restarts else ()))
+
+def generation_process(ring, types, stats_q, telemetry, seed, start_iteration):
+  last_report = time.time()
+  telemetry.register()
+  rng = np.random.default_rng(worker_seed(seed, start_iteration, telemetry.slot, telemetry.restarts))
+  telemetry.enter(BUSY)
+  while True:
+    curves, labels, _ = generate_batch(types, ring.block_rows, rng=rng)
+    mask = filter_batch(curves, labels, rng)
+    inputs, outputs = batch_inputs(curves, mask), expected_outputs_batch(labels)
+    telemetry.enter(BLOCKED)
+    ring.put(inputs, outputs)
+    telemetry.enter(BUSY, len(inputs))
+
+    if profiling.ENABLED and time.time() - last_report > PROFILE_REPORT_INTERVAL:
+      stats_q.put(profiling.snapshot(reset=True))
+      last_report = time.time()
+
+def collect_profiles(stats_q):
+  """ Merges the profiling snapshots sent by the workers so far. """
   while True:
-    for i in range(100):
-      event = get_event(types)
-      x, y = event.calculate_inputs(), event.expected_outputs()
-      q.put((x, y))
-
-def human_format(num):
-  num = float('{:.3g}'.format(num))
-  magnitude = 0
-  while abs(num) >= 1000:
-    magnitude += 1
-    num /= 1000.0
-  return '{}{}'.format('{:f}'.format(num).rstrip('0').rstrip('.'), ['', 'K', 'M', 'B', 'T'][magnitude])
+    try:
+      profiling.merge(stats_q.get_nowait())
+    except queue.Empty:
+      return
+
+# Samples generated and sent to the trainer at a time, and the blocks of them buffered
+RING_BLOCK = 100
+RING_BLOCKS = 30
+
+# Training iterations between snapshots sent to the evaluator
+EVAL_INTERVAL = 5
+
+# Learning rates per optimizer; momentum moves about 1/(1-momentum) times further per step
+DEFAULT_ETA = {'sgd': 0.35, 'momentum': 0.035, 'nesterov': 0.035, 'rmsprop': 0.005, 'adam': 0.005}
 
 def main():
   """ Executes the required calculations for an event, prints raw data and creates a graph. """
-  args = sys.argv
   global ax1
-
-  if len(args) <= 1 or not args[1].isdigit():
-    print("Usage: python train.py NUM_CORES")
-    exit()
-
-  num_cores = int(args[1])
+  parser = argparse.ArgumentParser(description="Train the network on generated lightcurves.")
+  parser.add_argument('num_cores', type=int, metavar='NUM_CORES', help="number of generation (or, with --parallel, training) processes")
+  parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint in the working directory")
+  parser.add_argument('--optimizer', choices=sorted(OPTIMIZERS), default='sgd', help="update rule of a new run (default: sgd)")
+  parser.add_argument('--eta', type=float, help="learning rate (default depends on the optimizer)")
+  parser.add_argument('--half-life', type=float, help="halve the learning rate every HALF_LIFE mini batches")
+  parser.add_argument('--parallel', choices=MODES, help="train in NUM_CORES processes: sync averages their gradients, hogwild lets each update the weights")
+  parser.add_argument('--patience', type=int, default=0, help="stop once PATIENCE evaluations in a row have not improved on the best accuracy")
+  parser.add_argument('--corpus', help="train on the corpus written by corpus.py in this directory instead of generating curves")
+  parser.add_argument('--seed', type=int, help="seed of the run, for reproducible generation, initial weights and shuffling")
+  args = parser.parse_args()
+  if args.corpus and args.parallel:
+    parser.error("--corpus and --parallel cannot be combined")
+
+  num_cores = args.num_cores
 
   #fig = plt.figure(figsize=(7, 7))
-  fig2 = plt.figure(figsize=(7, 7))
-  fig3 = plt.figure(figsize=(7, 7))
   #ax1 = fig.add_subplot(111)
-  plt.ion()
+  seed = np.random.SeedSequence(args.seed).entropy
+  random.seed(seed)
+  np.random.seed(np.random.SeedSequence(seed).generate_state(4))
   network_size = [LightCurve.INPUT_SIZE, 8, 8, LightCurve.OUTPUT_SIZE]
-  nn = Network(network_size)
+  nn = Network(network_size, optimizer=OPTIMIZERS[args.optimizer]())
+  nn.feature_version = LightCurve.FEATURE_VERSION
   recent_progress = []
   types = [MicroLensing, NonEvent, Periodic]
-  labels = ['AC_std', 'AC_max', 'SYM_std', 'SYM_max', 'excursion_diff', 'excursion_above', 'excursion_below', 'noise', 'slope', 'power_peak', 'power_mean']
-  labels += ["" for i in range(sum(network_size[1:-1]))]
-  labels += [ev().__class__.__name__ for ev in types]
 
-  q = mp.Queue(maxsize=3000)
-  pool = mp.Pool(num_cores, initializer=generation_process, initargs=(q, types))
-  accuracies = []
+  evaluations = []
+  history = {}
   total_gen = 0
   iterations = 0
 
-  rolling_accuracies = [[], [], []]
   batch_size = 1000
   batches_per_save = 30
 
+  checkpoint = load_checkpoint() if args.resume else None
+  if checkpoint is not None:
+    nn, state = checkpoint
+    evaluations = state.get('evaluations', [])
+    # Training accuracy windows of checkpoints from before held-out evaluation, kept for the plot
+    history = {key: state[key] for key in ['accuracies', 'rolling_accuracies'] if key in state}
+    total_gen, iterations = state['total_gen'], state['iterations']
+    restore_rng(state['rng'])
+    training = state.get('training', {})
+    args.optimizer = training.get('optimizer', 'sgd')
+    args.eta = args.eta or training.get('eta')
+    args.half_life = args.half_life or training.get('half_life')
+    seed = training.get('seed', seed) if args.seed is None else args.seed
+    print("Resumed from iteration "+str(iterations)+" ("+human_format(total_gen)+" lightcurves)")
+  elif args.resume:
+    print("No checkpoint found, starting a new run")
+  checkpoints = CheckpointWriter()
+
+  args.eta = args.eta or DEFAULT_ETA[args.optimizer]
+  training = {'optimizer': args.optimizer, 'eta': args.eta, 'half_life': args.half_life, 'seed': seed}
+  print("Run seed: "+str(seed))
+  eta = ExponentialDecay(args.eta, args.half_life) if args.half_life else args.eta
+
+  evaluator = Evaluator(types)
+  renderer = mp.Process(target=watch, daemon=True)
+  renderer.start()
+  stats_q = mp.Queue()
+  telemetry = Telemetry(0 if args.parallel or args.corpus else num_cores)
+  if args.parallel:
+    trainer = ParallelTrainer(nn, num_cores, types, batch_size, 250, 10, eta, mode=args.parallel,
+                              seeds=[worker_seed(seed, iterations, slot) for slot in range(num_cores)])
+  elif args.corpus:
+    corpus = Corpus(args.corpus)
+    if corpus.feature_version != LightCurve.FEATURE_VERSION:
+      print("Warning: "+args.corpus+" holds feature version "+str(corpus.feature_version)+", current is "+str(LightCurve.FEATURE_VERSION))
+    nn.feature_version = corpus.feature_version
+    batches = corpus.batches(batch_size, np.random.default_rng(worker_seed(seed, iterations, 0)))
+  else:
+    ring = Ring(LightCurve.INPUT_SIZE, LightCurve.OUTPUT_SIZE, RING_BLOCK, RING_BLOCKS)
+    pool = mp.Pool(num_cores, initializer=generation_process, initargs=(ring, types, stats_q, telemetry, seed, iterations))
+
   while True:
-    training_data = [q.get() for _ in range(batch_size)]
-    total_gen += len(training_data)
     iterations += 1
-    #draw_plot(get_event(types))
-    _, _, _, training_accuracy = nn.SGD(np.array(training_data),10,250,0.35,monitor_training_accuracy=True)
-
-    avg_acc = sum(training_accuracy) / len(training_accuracy) / len(training_data)
-    accuracies.insert(0, avg_acc)
-    accuracies = accuracies[:300]
+    if args.parallel:
+      with telemetry.phase('train'):
+        generated, _ = trainer.step()
+    elif args.corpus:
+      with telemetry.phase('wait'):
+        x, y = next(batches)
+      generated = len(x)
+      with telemetry.phase('train'):
+        nn.train_rows(x,y,10,250,eta)
+    else:
+      telemetry.sample_occupancy(ring.occupancy())
+      with telemetry.phase('wait'):
+        x, y = ring.get(batch_size // RING_BLOCK)
+      generated = len(x)
+      #draw_plot(get_event(types))
+      with telemetry.phase('train'):
+        nn.train_rows(x,y,10,250,eta)
+      ring.release(batch_size // RING_BLOCK)
+    total_gen += generated
+    telemetry.record_trained(generated)
+
+    with telemetry.phase('evaluate'):
+      if iterations % EVAL_INTERVAL == 0:
+        evaluator.submit(nn, iterations=iterations, total_gen=total_gen)
+      results = evaluator.poll()
+    for result in results:
+      evaluations.append(result)
+      print("Evaluation accuracy after "+human_format(result['total_gen'])+" lightcurves: "+str(round(100*result['accuracy'],2))+"%")
+    telemetry.tick(iterations=iterations, total_gen=total_gen)
     sys.stdout.flush()
 
-    if iterations % batches_per_save == 0:
-      ax2 = fig2.gca()
-      draw_neural_net(ax2, .05, .95, .08, .98, nn, None, labels)
-
-      avg_acc_300 = sum(accuracies) / len(accuracies)
-      avg_acc_150 = sum(accuracies[:150]) / min(len(accuracies), 150)
-      avg_acc_50 = sum(accuracies[:50]) / min(len(accuracies), 50)
-
-      rolling_accuracies[0].append(round(100*avg_acc_300,2))
-      rolling_accuracies[1].append(round(100*avg_acc_150,2))
-      rolling_accuracies[2].append(round(100*avg_acc_50,2))
-
-      txt = ax2.text(0.5, 0.06, "Current accuracy: "+str(round(100*avg_acc_150,2))+"%", color="#000000FF", ha='center', va='center')
-      txt = ax2.text(0.5, 0.03, "Total lightcurves generated: "+human_format(total_gen), color="#000000FF", ha='center', va='center')
-      txt = ax2.text(0.5, 0, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), color="#666666FF", ha='center', va='center')
-      nn.save(datetime.datetime.now().strftime("NN-%Y-%m-%d.json"))
-
-      ax3 = fig3.gca()
-
-      accuracy_x = np.linspace(0, len(rolling_accuracies[0]) * batch_size * batches_per_save, len(rolling_accuracies[0]))
-
-      ax3.plot(accuracy_x, rolling_accuracies[0], color=(0,0,1,1), label='Last 300K')
-      ax3.plot(accuracy_x, rolling_accuracies[1], color=(0,0,1,0.5), label='Last 150K')
-      ax3.plot(accuracy_x, rolling_accuracies[2], color=(0,0,1,0.25), label='Last 50K')
-      ax3.legend()
-      ax3.set_xlabel("Lightcurves Processed")
-      ax3.set_ylabel("Average Accuracy (%)")
-      ax3.set_title("Network Accuracy")
-
-      fig3.savefig('accuracy.png')
-      fig3.clf()
-
-      fig2.savefig('nn.png')
-      fig2.clf()
+    accuracy = [result['accuracy'] for result in evaluations]
+    stop = args.patience and accuracy and len(accuracy) - 1 - np.argmax(accuracy) >= args.patience
+
+    if iterations % batches_per_save == 0 or stop:
+      with telemetry.phase('save'):
+        state = dict(history, iterations=iterations, total_gen=total_gen, evaluations=evaluations, rng=rng_state(), training=training)
+        checkpoints.save(nn, state, [datetime.datetime.now().strftime("NN-%Y-%m-%d.nnb")])
+
+      print(telemetry.summary())
+      if args.parallel:
+        print("Training throughput: {:.1f} curves/s with {} workers".format(trainer.throughput(), num_cores))
+
+      if profiling.ENABLED:
+        collect_profiles(stats_q)
+        profiling.export('profile')
+
+    if stop:
+      print("No improvement in the last "+str(args.patience)+" evaluations, stopping")
+      checkpoints.flush()
+      watch(once=True)
+      if args.parallel:
+        trainer.close()
+      elif not args.corpus:
+        pool.terminate()
+        ring.close()
+      return
 
 
 
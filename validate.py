@@ -5,8 +5,10 @@ import numpy as np
 import random
 import time
 from lightcurve import *
-from network import Network, load
+from network import Network, load, Ensemble, mean_outputs, vote_fractions, majority_vote
 from raw_nodes import pspec, excursion
+from cadence import CadencePlan
+from feature_cache import cached_features
 import datetime
 
 plot = None
@@ -44,7 +46,7 @@ def main():
   args = sys.argv
 
   if len(args) <= 2 or not args[1].isdigit():
-    print("Usage: python validate.py EXAMPLE_ID NETWORK_FILE")
+    print("Usage: python validate.py EXAMPLE_ID NETWORK_FILE [NETWORK_FILE ...]")
     exit()
 
   ex_id = args[1]
@@ -59,27 +61,40 @@ def main():
   #event.load_curve(dates, flux[curve_of_interest], flux_err[curve_of_interest])
   #return draw_plot(event)
 
-  num_microlensing = 0
-  ml_events = []
-  network = load(args[2])
-
-  for i in range(len(flux)):
-    lightcurve = LightCurve()
-    lightcurve.load_curve(dates, flux[i], flux_err[i])
-    inputs = lightcurve.calculate_inputs()
-    activations = network.activations(inputs)
-    if np.argmax(activations[3]) == 0:
-      num_microlensing += 1
-      ml_events.append((i, activations[3][0][0]))
-    percent = round(100 * num_microlensing / (i+1), 2)
-    if i == len(flux) - 1:
-      print("\r Validation complete, result: Error "+str(percent)+"% ("+str(num_microlensing)+" / "+str(i+1)+")")
-      print("Index, Activation")
-      for ind, act in sorted(ml_events, key=lambda x: x[1]):
-        print(str(ind)+", "+str(round(act, 2)))
-    else:
-      print(" "+str(num_microlensing)+" / "+str(i+1)+" (Error "+str(percent)+"%)", end="\r")
-    sys.stdout.flush()
+  filenames = args[2:]
+  networks = [load(filename) for filename in filenames]
+  for filename, network in zip(filenames, networks):
+    if network.feature_version not in (None, LightCurve.FEATURE_VERSION):
+      print("Warning: "+filename+" was trained on feature version "+str(network.feature_version)+", current is "+str(LightCurve.FEATURE_VERSION))
+  ensemble = Ensemble(networks)
+  names = ensemble.inputs or LightCurve.INPUT_NAMES
+  inputs = cached_features(directory+'cache/', [np.array(names), dates, flux, flux_err], lambda: CadencePlan(dates).inputs(flux, flux_err, names))
+
+  model_outputs = ensemble.predict_batch(inputs)
+  outputs = mean_outputs(model_outputs)
+
+  if len(ensemble) > 1:
+    print("Network, Error")
+    for filename, model_output in zip(filenames, model_outputs):
+      num_microlensing = int(np.sum(np.argmax(model_output, axis=1) == 0))
+      print(filename+", "+str(round(100 * num_microlensing / len(flux), 2))+"% ("+str(num_microlensing)+" / "+str(len(flux))+")")
+    votes = vote_fractions(model_outputs)
+    num_voted = int(np.sum(majority_vote(model_outputs) == 0))
+    print("Majority vote: Error "+str(round(100 * num_voted / len(flux), 2))+"% ("+str(num_voted)+" / "+str(len(flux))+")")
+
+  ml_events = np.flatnonzero(np.argmax(outputs, axis=1) == 0)
+  num_microlensing = len(ml_events)
+  percent = round(100 * num_microlensing / len(flux), 2)
+  print("Validation complete, result: Error "+str(percent)+"% ("+str(num_microlensing)+" / "+str(len(flux))+")")
+  if len(ensemble) > 1:
+    print("Index, Mean activation, Votes")
+    for ind in ml_events[np.argsort(outputs[ml_events, 0], kind='stable')]:
+      print(str(ind)+", "+str(round(outputs[ind, 0], 2))+", "+str(round(votes[ind, 0], 2)))
+  else:
+    print("Index, Activation")
+    for ind in ml_events[np.argsort(outputs[ml_events, 0], kind='stable')]:
+      print(str(ind)+", "+str(round(outputs[ind, 0], 2)))
+  sys.stdout.flush()
 
 
 